@@ -0,0 +1,440 @@
+"""Benchmarks the downloader against a synthetic Stogram database and stub executables.
+
+Run from anywhere on Linux, fully offline:
+
+    python bench/benchmark.py --sizes 10000 100000 --save-baseline baseline.json
+    python bench/benchmark.py --sizes 10000 100000 --compare baseline.json
+
+Every case runs in a fresh child process inside a throwaway copy of the database, so peak RSS
+and timings of one case never leak into the next.
+"""
+import argparse
+import json
+import os
+import resource
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+SRC_DIR = Path(__file__).resolve().parent.parent / "src"
+
+# === DEFAULT BENCHMARK VALUES ===
+DEFAULT_SIZES = (10000, 100000, 1000000)
+CASES = ("fetch_users", "dedupe", "download_media", "add_manual_media", "rate_limit")
+DEFAULT_USERS = 500
+DEFAULT_FILES = 500
+DEFAULT_TREE_FILES = 2000
+DEFAULT_FILE_SIZE = 64 * 1024
+DEFAULT_VIDEO_EVERY = 5
+BENCH_USER = "bench_user"
+DB_NAME = "bench.stogram.sqlite"
+RESULT_MARKER = "BENCH_RESULT "
+INSERT_CHUNK = 50000
+# The rate_limit case syncs this many users, each with a few files, on a small pool
+RATE_LIMIT_JOBS = 12
+RATE_LIMIT_WORKERS = 4
+RATE_LIMIT_FILES = 5
+RATE_LIMIT_ATTEMPTS = 10
+
+GALLERY_DL_STUB = """#!/bin/sh
+# Stand-in for gallery-dl: writes BENCH_GDL_FILES unique files into the -D folder and prints their paths.
+# With BENCH_THROTTLE_LIMIT set it answers like a throttled Instagram (HTTP 429, exit code 4) once more
+# than that many launches happened in the last BENCH_THROTTLE_WINDOW seconds.
+start=$(date +%s%N)
+if [ -n "$BENCH_THROTTLE_LIMIT" ]; then
+    echo "$start" >> "$BENCH_LAUNCH_LOG"
+    recent=$(awk -v now="$start" -v window="$BENCH_THROTTLE_WINDOW" 'now - $1 <= window * 1e9' "$BENCH_LAUNCH_LOG" | wc -l)
+    if [ "$recent" -gt "$BENCH_THROTTLE_LIMIT" ]; then
+        echo "[instagram][error] HTTP Error 429: Too Many Requests" >&2
+        exit 4
+    fi
+fi
+while [ $# -gt 0 ]; do
+    if [ "$1" = "-D" ]; then dir=$2; fi
+    shift
+done
+i=0
+while [ $i -lt "${BENCH_GDL_FILES:-100}" ]; do
+    if [ "${BENCH_GDL_LATENCY:-0}" != "0" ]; then sleep "$BENCH_GDL_LATENCY"; fi
+    if [ $((i % ${BENCH_VIDEO_EVERY:-5})) -eq 0 ]; then ext=mp4; else ext=jpg; fi
+    f="$dir/new_$i.$ext"
+    { echo "$f"; head -c "${BENCH_FILE_SIZE:-65536}" /dev/zero; } > "$f"
+    echo "$f"
+    i=$((i + 1))
+done
+end=$(date +%s%N)
+echo "gallery-dl $((end - start))" >> "$BENCH_STUB_LOG"
+"""
+
+FFMPEG_STUB = """#!/bin/sh
+# Stand-in for ffmpeg: answers duration probes, otherwise waits BENCH_FFMPEG_LATENCY seconds and
+# writes its last argument
+case " $* " in
+    *" -frames:v "*) ;;
+    *) echo "  Duration: 00:00:10.00, start: 0.000000, bitrate: 1000 kb/s" >&2; exit 1 ;;
+esac
+start=$(date +%s%N)
+for last; do :; done
+if [ "${BENCH_FFMPEG_LATENCY:-0}" != "0" ]; then sleep "$BENCH_FFMPEG_LATENCY"; fi
+echo thumb > "$last"
+end=$(date +%s%N)
+echo "ffmpeg $((end - start))" >> "$BENCH_STUB_LOG"
+"""
+
+
+def log(text):
+    print(text, flush=True)
+
+
+# === SYNTHETIC DATA ===
+
+def build_database(path, rows, users, file_index=False):
+    """Creates a Stogram-like database with `rows` photos spread over `users` subscriptions.
+
+    The benchmark user owns a tenth of the rows (at least 1000), so per-user lookups see a
+    large account.
+    """
+    tmp_path = path.with_suffix(".tmp")
+    if tmp_path.exists():
+        tmp_path.unlink()
+    conn = sqlite3.connect(str(tmp_path))
+    conn.execute("PRAGMA journal_mode = OFF")
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute(
+        "CREATE TABLE subscriptions (id BLOB, query TEXT, attributes TEXT, display_name TEXT, "
+        "date_added TEXT, instagram_id INTEGER)"
+    )
+    conn.execute(
+        "CREATE TABLE photos (id INTEGER PRIMARY KEY, subscriptionId BLOB, created_time INTEGER, "
+        "thumbnail_file TEXT, file TEXT, ownerName TEXT, ownerId INTEGER)"
+    )
+    subscriptions = [(uuid.uuid4().bytes, BENCH_USER, 1)]
+    subscriptions += [(uuid.uuid4().bytes, f"user{i:05d}", 1000 + i) for i in range(1, users)]
+    conn.executemany(
+        "INSERT INTO subscriptions VALUES (?, ?, '{}', ?, '2025-01-01T00:00:00', ?)",
+        ((blob, name, name, owner_id) for blob, name, owner_id in subscriptions)
+    )
+
+    bench_rows = min(rows, max(1000, rows // 10))
+
+    def photo_rows():
+        blob, name, owner_id = subscriptions[0]
+        for i in range(bench_rows):
+            file = f"instagram/{name}/img_{i}.jpg"
+            yield blob, 1700000000 + i, file, file, name, owner_id
+        others = subscriptions[1:] or subscriptions
+        for i in range(rows - bench_rows):
+            blob, name, owner_id = others[i % len(others)]
+            file = f"instagram/{name}/img_{i}.jpg"
+            yield blob, 1700000000 + i, file, file, name, owner_id
+
+    batch = []
+    for row in photo_rows():
+        batch.append(row)
+        if len(batch) >= INSERT_CHUNK:
+            conn.executemany("INSERT INTO photos (subscriptionId, created_time, thumbnail_file, file, ownerName, "
+                             "ownerId) VALUES (?, ?, ?, ?, ?, ?)", batch)
+            batch = []
+    if batch:
+        conn.executemany("INSERT INTO photos (subscriptionId, created_time, thumbnail_file, file, ownerName, "
+                         "ownerId) VALUES (?, ?, ?, ?, ?, ?)", batch)
+    if file_index:
+        conn.execute("CREATE INDEX idx_photos_file ON photos(file)")
+    conn.commit()
+    conn.close()
+    os.replace(tmp_path, path)
+
+
+def write_unique_file(path, size):
+    with open(path, "wb") as f:
+        f.write(str(path).encode() + b"\n")
+        f.write(b"\0" * size)
+
+
+def prepare_run_dir(run_dir, db_path, args):
+    """Lays out a fresh working directory: database copy, stub assets, media tree and import sources."""
+    if run_dir.exists():
+        shutil.rmtree(run_dir)
+    (run_dir / "assets").mkdir(parents=True)
+    shutil.copyfile(db_path, run_dir / DB_NAME)
+    for name, script in (("gallery-dl.exe", GALLERY_DL_STUB), ("ffmpeg.exe", FFMPEG_STUB)):
+        stub = run_dir / "assets" / name
+        stub.write_text(script)
+        stub.chmod(0o755)
+
+    user_dir = run_dir / "instagram" / BENCH_USER
+    user_dir.mkdir(parents=True)
+    for i in range(args.tree_files):
+        write_unique_file(user_dir / f"img_{i}.jpg", 1024)
+
+    import_dir = run_dir / "import_src"
+    import_dir.mkdir()
+    for i in range(args.files):
+        ext = "mp4" if i % args.video_every == 0 else "jpg"
+        write_unique_file(import_dir / f"manual_{i}.{ext}", args.file_size)
+
+
+# === CASES (run inside the child process) ===
+
+def stub_seconds(log_path):
+    total = 0.0
+    try:
+        with open(log_path, "r") as f:
+            for line in f:
+                total += int(line.split()[1]) / 1e9
+    except OSError:
+        pass
+    return total
+
+
+def bench_user_blob(downloader):
+    for blob, username in downloader.fetch_users():
+        if username == BENCH_USER:
+            return blob
+    raise RuntimeError(f"{BENCH_USER} is missing from the benchmark database")
+
+
+def case_fetch_users(downloader, args):
+    started = time.perf_counter()
+    users = downloader.fetch_users()
+    return {"elapsed": time.perf_counter() - started, "items": len(users)}
+
+
+def case_dedupe(downloader, args):
+    """The per-job known-files load, in-memory checks and the writer's bulk IN query."""
+    repository = downloader.get_repository()
+    blob = bench_user_blob(downloader)
+    repository.sql_seconds = 0.0
+    candidates = [f"instagram/{BENCH_USER}/img_{i}.jpg" for i in range(0, args.files * 20, 2)]
+    started = time.perf_counter()
+    known = repository.known_files(blob)
+    hits = sum(1 for file in candidates if file in known)
+    found = repository.existing_files(candidates)
+    elapsed = time.perf_counter() - started
+    assert hits == len(found)
+    return {"elapsed": elapsed, "items": len(candidates), "known_files": len(known)}
+
+
+def case_download_media(downloader, args):
+    from ingest import DatabaseWriter
+    from thumbnails import ThumbnailStage
+
+    blob = bench_user_blob(downloader)
+    repository = downloader.get_repository()
+    repository.sql_seconds = 0.0
+    started = time.perf_counter()
+    thumbnails = ThumbnailStage(downloader.FFMPEG_EXE)
+    writer = DatabaseWriter(repository).start()
+    try:
+        inserted = downloader.download_media(blob, BENCH_USER, lambda text: None, "Posts", 0, "firefox",
+                                      writer=writer, thumbnails=thumbnails)
+    finally:
+        thumbnails.close()
+        writer.close()
+    elapsed = time.perf_counter() - started
+    if writer.errors:
+        raise writer.errors[0]
+    return {"elapsed": elapsed, "items": args.files, "inserted": inserted}
+
+
+def case_add_manual_media(downloader, args):
+    blob = bench_user_blob(downloader)
+    repository = downloader.get_repository()
+    repository.sql_seconds = 0.0
+    files = sorted(Path("import_src").iterdir())
+    started = time.perf_counter()
+    inserted = downloader.insert_manual_media(blob, BENCH_USER, files, lambda text: None, strategy=args.import_strategy)
+    return {"elapsed": time.perf_counter() - started, "items": len(files), "inserted": inserted}
+
+
+def case_rate_limit(downloader, args):
+    """Syncs several users through one DownloadScheduler against a gallery-dl stub that throttles bursts.
+
+    A failed sync is retried, so `elapsed` is the time until every user is in sync. With
+    --launches-per-minute 0 the jobs run without a scheduler, for comparison.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from ingest import DatabaseWriter
+    from thumbnails import ThumbnailStage
+    from ratelimit import DownloadScheduler
+
+    os.environ["BENCH_THROTTLE_LIMIT"] = str(args.throttle_limit)
+    os.environ["BENCH_THROTTLE_WINDOW"] = str(args.throttle_window)
+    os.environ["BENCH_LAUNCH_LOG"] = str(Path("launches.log").resolve())
+    os.environ["BENCH_GDL_FILES"] = str(RATE_LIMIT_FILES)
+    users = [user for user in downloader.fetch_users() if user[1] != BENCH_USER][:RATE_LIMIT_JOBS]
+    scheduler = None
+    if args.launches_per_minute > 0:
+        scheduler = DownloadScheduler(args.launches_per_minute, burst=RATE_LIMIT_WORKERS,
+                                      max_concurrency=RATE_LIMIT_WORKERS, throttle_pause=args.throttle_window / 2)
+    thumbnails = ThumbnailStage(downloader.FFMPEG_EXE)
+    writer = DatabaseWriter(downloader.get_repository()).start()
+
+    def sync(blob, username):
+        for attempt in range(1, RATE_LIMIT_ATTEMPTS + 1):
+            if downloader.download_media(blob, username, lambda text: None, "Posts", 0, "firefox", writer=writer,
+                                  thumbnails=thumbnails, scheduler=scheduler) is not None:
+                return attempt
+        return None
+
+    started = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=RATE_LIMIT_WORKERS) as pool:
+            attempts = list(pool.map(lambda user: sync(*user), users))
+    finally:
+        thumbnails.close()
+        writer.close()
+    return {
+        "elapsed": time.perf_counter() - started,
+        "items": len(users),
+        "completed": sum(1 for n in attempts if n is not None),
+        "launches": sum(n or RATE_LIMIT_ATTEMPTS for n in attempts),
+        "final_concurrency": scheduler.concurrency if scheduler else None,
+    }
+
+
+def run_case(args):
+    """Child process entry point: runs one case in the current directory and prints its result."""
+    os.environ["BENCH_STUB_LOG"] = str(Path("stubs.log").resolve())
+    os.environ["BENCH_GDL_FILES"] = str(args.files)
+    os.environ["BENCH_GDL_LATENCY"] = str(args.gdl_latency)
+    os.environ["BENCH_FFMPEG_LATENCY"] = str(args.ffmpeg_latency)
+    os.environ["BENCH_FILE_SIZE"] = str(args.file_size)
+    os.environ["BENCH_VIDEO_EVERY"] = str(args.video_every)
+    sys.path.insert(0, str(SRC_DIR))
+    import downloader
+
+    result = globals()[f"case_{args.run_case}"](downloader, args)
+    # Rows committed after the job's last checkpoint are only marked inserted on close
+    downloader.close_journal()
+    result["sql_seconds"] = downloader.get_repository().sql_seconds
+    result["subprocess_seconds"] = stub_seconds(os.environ["BENCH_STUB_LOG"])
+    result["files_per_second"] = result["items"] / result["elapsed"] if result["elapsed"] > 0 else 0.0
+    # ru_maxrss is in kilobytes on Linux
+    result["peak_rss_mb"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(RESULT_MARKER + json.dumps(result), flush=True)
+
+
+# === DRIVER ===
+
+def child_args(args, case):
+    return [
+        sys.executable, str(Path(__file__).resolve()), "--run-case", case,
+        "--files", str(args.files), "--gdl-latency", str(args.gdl_latency),
+        "--ffmpeg-latency", str(args.ffmpeg_latency), "--file-size", str(args.file_size),
+        "--video-every", str(args.video_every), "--import-strategy", args.import_strategy,
+        "--throttle-limit", str(args.throttle_limit), "--throttle-window", str(args.throttle_window),
+        "--launches-per-minute", str(args.launches_per_minute),
+    ]
+
+
+def run_suite(args):
+    workdir = Path(args.workdir)
+    workdir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    for rows in args.sizes:
+        suffix = "_indexed" if args.file_index else ""
+        db_path = workdir / f"db_{rows}_{args.users}{suffix}.sqlite"
+        if args.rebuild or not db_path.exists():
+            log(f"Building synthetic database with {rows} rows...")
+            started = time.perf_counter()
+            build_database(db_path, rows, args.users, args.file_index)
+            log(f"  built in {time.perf_counter() - started:.1f}s")
+        for case in args.cases:
+            run_dir = workdir / "run"
+            prepare_run_dir(run_dir, db_path, args)
+            proc = subprocess.run(child_args(args, case), cwd=run_dir, stdout=subprocess.PIPE,
+                                  stderr=subprocess.STDOUT, text=True)
+            lines = [line for line in proc.stdout.splitlines() if line.startswith(RESULT_MARKER)]
+            if proc.returncode != 0 or not lines:
+                log(f"❌ {case} at {rows} rows failed:\n{proc.stdout[-2000:]}")
+                continue
+            results[f"{rows}/{case}"] = json.loads(lines[-1][len(RESULT_MARKER):])
+            log(format_row(rows, case, results[f"{rows}/{case}"]))
+    return results
+
+
+def format_row(rows, case, result, baseline=None):
+    line = (
+        f"{rows:>9} {case:<17} {result['elapsed']:>9.3f}s {result['files_per_second']:>11.1f}/s "
+        f"sql {result['sql_seconds']:>7.3f}s  subprocess {result['subprocess_seconds']:>7.3f}s  "
+        f"rss {result['peak_rss_mb']:>7.1f} MB"
+    )
+    if baseline:
+        change = (result["elapsed"] - baseline["elapsed"]) / baseline["elapsed"] * 100 if baseline["elapsed"] else 0
+        line += f"  {change:+6.1f}% vs baseline"
+    return line
+
+
+def print_report(results, baseline):
+    log("\n=== Benchmark summary ===")
+    for key, result in results.items():
+        rows, case = key.split("/")
+        log(format_row(int(rows), case, result, baseline.get(key)))
+    missing = sorted(set(baseline) - set(results))
+    if missing:
+        log(f"Not run this time: {', '.join(missing)}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the downloader against synthetic data.")
+    parser.add_argument("--sizes", nargs="+", type=int, default=list(DEFAULT_SIZES),
+                        help="Number of photos rows in each synthetic database")
+    parser.add_argument("--cases", nargs="+", choices=CASES, default=list(CASES))
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS, help="Number of subscriptions")
+    parser.add_argument("--files", type=int, default=DEFAULT_FILES,
+                        help="New files per download or manual import")
+    parser.add_argument("--tree-files", type=int, default=DEFAULT_TREE_FILES,
+                        help="Files already in the benchmark user's folder")
+    parser.add_argument("--file-size", type=int, default=DEFAULT_FILE_SIZE, help="Bytes per new file")
+    parser.add_argument("--video-every", type=int, default=DEFAULT_VIDEO_EVERY,
+                        help="Every n-th new file is an .mp4 that needs a thumbnail")
+    parser.add_argument("--gdl-latency", type=float, default=0.0, help="Seconds the gallery-dl stub waits per file")
+    parser.add_argument("--ffmpeg-latency", type=float, default=0.02,
+                        help="Seconds the ffmpeg stub waits per thumbnail")
+    parser.add_argument("--import-strategy", default="copy", help="Strategy used by the add_manual_media case")
+    parser.add_argument("--file-index", action="store_true", help="Give photos.file an index")
+    parser.add_argument("--throttle-limit", type=int, default=3,
+                        help="rate_limit case: launches the gallery-dl stub accepts per throttle window")
+    parser.add_argument("--throttle-window", type=float, default=2.0,
+                        help="rate_limit case: seconds over which the stub counts launches")
+    parser.add_argument("--launches-per-minute", type=float, default=120,
+                        help="rate_limit case: scheduler launch rate (0 = no scheduler)")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "stogram-bench"),
+                        help="Where databases and run folders are kept between runs")
+    parser.add_argument("--rebuild", action="store_true", help="Rebuild cached synthetic databases")
+    parser.add_argument("--save-baseline", metavar="PATH", help="Write the results to this JSON file")
+    parser.add_argument("--compare", metavar="PATH", help="Compare against a baseline JSON file")
+    parser.add_argument("--run-case", choices=CASES, help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.run_case:
+        run_case(args)
+        return 0
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+
+    results = run_suite(args)
+    print_report(results, baseline)
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump({"settings": {k: v for k, v in vars(args).items() if k not in ("save_baseline", "compare")},
+                       "results": results}, f, indent=1)
+        log(f"Baseline written to {args.save_baseline}")
+    return 0 if len(results) == len(args.sizes) * len(args.cases) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,16 +1,22 @@
 import tkinter as tk
-from tkinter import font
-import sqlite3
+from tkinter import font, messagebox
+import argparse
+import re
 import uuid
 import os
 import sys
 import ctypes
 from datetime import datetime
+from repository import StogramRepository
 
 # --- Constants ---
 DB_NAME = ".stogram.sqlite"
 TABLE_NAME = "subscriptions"
+MEDIA_TABLE = "photos"
 ATTRIBUTES = '{"limited":"_BASE64_MA==","sortMode":"_BASE64_MQ==","visualIndex":"_BASE64_LTE="}'
+# Instagram usernames: up to 30 letters, digits, periods and underscores
+USERNAME_PATTERN = re.compile(r"^[a-z0-9._]{1,30}$")
+PROFILE_URL_PATTERN = re.compile(r"^(?:https?://)?(?:www\.)?instagram\.com/([^/?#]+)", re.IGNORECASE)
 
 # --- Utility Functions ---
 
@@ -37,6 +43,65 @@ def generate_subscription_id():
     hex_string = uuid.uuid4().hex
     return bytes.fromhex(hex_string), hex_string
 
+def normalize_username(text):
+    """Turns '@Name', 'instagram.com/name/' and similar into 'name'; returns None if it is not a valid username."""
+    text = text.strip()
+    match = PROFILE_URL_PATTERN.match(text)
+    if match:
+        text = match.group(1)
+    username = text.lstrip("@").lower()
+    return username if USERNAME_PATTERN.match(username) else None
+
+def bulk_add_subscriptions(db_path, lines):
+    """Adds every username in `lines` that is not subscribed yet, in one transaction.
+
+    Returns a dict with the "added" (username, hex ID) pairs, the "skipped" (username, reason)
+    pairs and the "invalid" entries.
+    """
+    result = {"added": [], "skipped": [], "invalid": []}
+    usernames = []
+    seen = set()
+    for line in lines:
+        entry = line.strip()
+        if not entry or entry.startswith("#"):
+            continue
+        username = normalize_username(entry)
+        if username is None:
+            result["invalid"].append(entry)
+        elif username in seen:
+            result["skipped"].append((username, "listed twice"))
+        else:
+            seen.add(username)
+            usernames.append(username)
+
+    repository = StogramRepository(db_path, MEDIA_TABLE, TABLE_NAME)
+    try:
+        existing = {name.lower() for name in repository.subscription_names() if name}
+        date_added = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
+        rows = []
+        for username in usernames:
+            if username in existing:
+                result["skipped"].append((username, "already subscribed"))
+                continue
+            sub_id_blob, sub_id_hex = generate_subscription_id()
+            rows.append((sub_id_blob, username, ATTRIBUTES, date_added))
+            result["added"].append((username, sub_id_hex))
+        if rows:
+            repository.add_subscriptions(rows)
+    finally:
+        repository.close()
+    return result
+
+def format_bulk_summary(result):
+    lines = [
+        f"Added: {len(result['added'])}  Skipped: {len(result['skipped'])}  Invalid: {len(result['invalid'])}",
+        ""
+    ]
+    lines += [f"✅ {username} ({sub_id_hex})" for username, sub_id_hex in result["added"]]
+    lines += [f"⏭️ {username} ({reason})" for username, reason in result["skipped"]]
+    lines += [f"❌ {entry} (not a valid username)" for entry in result["invalid"]]
+    return "\n".join(lines)
+
 def center_window(window, width, height):
     """Centers a Tkinter window on the screen."""
     screen_width = window.winfo_screenwidth()
@@ -87,17 +152,9 @@ def add_subscription(username_entry, root_window):
     sub_id_blob, sub_id_hex = generate_subscription_id()
     date_added = datetime.now().strftime("%Y-%m-%dT%H:%M:%S")
 
+    repository = StogramRepository(db_path, MEDIA_TABLE, TABLE_NAME)
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-
-        cursor.execute(f"""
-            INSERT INTO {TABLE_NAME} (id, query, attributes, display_name, date_added)
-            VALUES (?, ?, ?, ?, ?)
-        """, (sub_id_blob, username, ATTRIBUTES, username, date_added))
-
-        conn.commit()
-        conn.close()
+        repository.add_subscription(sub_id_blob, username, ATTRIBUTES, date_added)
 
         success_message = f"✅ Subscription added!\n\nUser: {username}\nID (hex): {sub_id_hex}\nDate: {date_added}"
         show_copyable_message("Success", success_message)
@@ -106,6 +163,25 @@ def add_subscription(username_entry, root_window):
 
     except Exception as e:
         tk.messagebox.showerror("Database Error", str(e))
+    finally:
+        repository.close()
+
+def bulk_add(text_widget):
+    """Adds every username pasted into the bulk text box."""
+    db_path = get_db_path()
+
+    if not os.path.exists(db_path):
+        tk.messagebox.showerror("Database Error", f"Database '{DB_NAME}' not found.")
+        return
+
+    try:
+        result = bulk_add_subscriptions(db_path, text_widget.get("1.0", tk.END).splitlines())
+    except Exception as e:
+        tk.messagebox.showerror("Database Error", str(e))
+        return
+
+    show_copyable_message("Bulk Import", format_bulk_summary(result))
+    text_widget.delete("1.0", tk.END)
 
 def setup_ui(root):
     """Sets up the main application window and its widgets."""
@@ -128,7 +204,40 @@ def setup_ui(root):
                            command=lambda: add_subscription(username_entry, root))
     add_button.pack(pady=20)
 
+    tk.Label(main_frame, text="Or paste many usernames (one per line):", font=app_font).pack(pady=(10, 5))
+
+    bulk_text = tk.Text(main_frame, font=("Segoe UI", 11), height=8)
+    bulk_text.pack(fill="both", expand=True, padx=20, pady=5)
+
+    bulk_button = tk.Button(main_frame, text="Add All", font=button_font, command=lambda: bulk_add(bulk_text))
+    bulk_button.pack(pady=10)
+
+def run_cli(argv):
+    parser = argparse.ArgumentParser(description="Add Instagram subscriptions to the 4K Stogram database.")
+    parser.add_argument("usernames", nargs="*", help="Usernames or profile URLs to add")
+    parser.add_argument("--file", "-f", help="Read usernames from this file, one per line ('-' for stdin)")
+    parser.add_argument("--db", default=None, help="Path to the database (default: next to this program)")
+    args = parser.parse_args(argv)
+
+    lines = list(args.usernames)
+    if args.file == "-":
+        lines += sys.stdin.read().splitlines()
+    elif args.file:
+        with open(args.file, "r", encoding="utf-8-sig") as f:
+            lines += f.read().splitlines()
+
+    db_path = args.db or get_db_path()
+    if not os.path.exists(db_path):
+        print(f"❌ Database '{db_path}' not found.")
+        return 2
+
+    result = bulk_add_subscriptions(db_path, lines)
+    print(format_bulk_summary(result))
+    return 0
+
 def main():
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     enable_high_dpi()
     root = tk.Tk()
     setup_ui(root)
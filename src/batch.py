@@ -0,0 +1,299 @@
+import argparse
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from downloader import (
+    MEDIA_TABLE, FFMPEG_EXE, GDL_INCLUDE_OPTIONS, CONTENT_INDEX_FILE, DEFAULT_DUPLICATES, REPORT_DIR, fetch_users,
+    find_database, validate_database, download_media, load_settings, get_repository, close_journal,
+    resume_journal, get_profiles, DownloadCancelled
+)
+from ingest import DatabaseWriter
+from thumbnails import ThumbnailStage
+from content_index import ContentIndex, DUPLICATE_POLICIES
+from telemetry import StageReport, new_run_id, write_json
+from ratelimit import DownloadScheduler, DEFAULT_LAUNCHES_PER_MINUTE
+
+# === DEFAULT BATCH VALUES ===
+DEFAULT_WORKERS = 4
+DEFAULT_TIMEOUT = 30 * 60
+DEFAULT_POST_LIMIT = 10
+# A user whose last sync found nothing new is skipped for this long (longer after several empty syncs)
+DEFAULT_QUIET_HOURS = 6
+
+_print_lock = threading.Lock()
+
+
+def log(text):
+    """Thread-safe print so lines from concurrent jobs never interleave."""
+    with _print_lock:
+        print(text, flush=True)
+
+
+class SharedStages:
+    """The stages every job of a batch or watch run shares, and the run's report.
+
+    Setting `cancel` stops every job it was passed to. `results` (the per-user result records,
+    if any) are written into the run report.
+    """
+
+    def __init__(self, report, thumbnails, writer, content_index, scheduler):
+        self.report = report
+        self.thumbnails = thumbnails
+        self.writer = writer
+        self.content_index = content_index
+        self.scheduler = scheduler
+        self.cancel = threading.Event()
+        self.results = None
+
+
+@contextmanager
+def shared_stages(mode, workers=DEFAULT_WORKERS, duplicates=DEFAULT_DUPLICATES,
+                  launches_per_minute=DEFAULT_LAUNCHES_PER_MINUTE, **info):
+    """Opens the stages shared by the jobs of one run and yields them as SharedStages.
+
+    One ThumbnailStage, one DatabaseWriter (which marks committed rows in the job journal), one
+    ContentIndex unless `duplicates` is "keep", and a DownloadScheduler that lets at most
+    `workers` gallery-dl runs start at once. Work an interrupted run left in the job journal is
+    finished before the first job. On exit everything is closed, the summaries are logged and
+    the stage timings of the whole run are written to REPORT_DIR/run-<id>.json.
+    """
+    run_report = StageReport(run_id=new_run_id(), mode=mode, workers=workers, **info)
+    thumbnails = ThumbnailStage(FFMPEG_EXE)
+    writer = DatabaseWriter(get_repository(), report=run_report).start()
+    content_index = ContentIndex(CONTENT_INDEX_FILE) if duplicates != "keep" else None
+    stages = SharedStages(run_report, thumbnails, writer, content_index,
+                          DownloadScheduler(launches_per_minute, max_concurrency=workers))
+    try:
+        resume_journal(log, writer, thumbnails)
+        yield stages
+    finally:
+        thumbnails.close()
+        writer.close()
+        if content_index is not None:
+            log(content_index.summary())
+            content_index.close()
+        close_journal()
+
+        log(stages.scheduler.summary())
+        log(thumbnails.summary())
+        log(writer.summary())
+        for error in writer.errors:
+            log(f"❌ Database write failed: {error}")
+
+        report_path = REPORT_DIR / f"run-{run_report.info['run_id']}.json"
+        record = run_report.to_dict()
+        if stages.results is not None:
+            record["users"] = stages.results
+        try:
+            write_json(report_path, record)
+            log(f"Run report written to {report_path}")
+        except OSError as e:
+            log(f"⚠️ Could not write the run report: {e}")
+
+
+def sync_user(subscription_id_blob, username, writer, thumbnails, media_type, post_limit, browser, timeout,
+              stream=True, metadata=False, content_index=None, duplicates=DEFAULT_DUPLICATES, report=None,
+              profile=False, scheduler=None, cancel=None):
+    """Runs one download job and returns its result record for the summary.
+
+    Setting the `cancel` event stops the job, which then has the status "cancelled".
+    """
+    started = time.monotonic()
+    result = {"username": username, "status": "ok", "inserted": 0, "error": None}
+    try:
+        inserted = download_media(
+            subscription_id_blob, username, lambda text: log(f"[{username}] {text}"),
+            media_type, post_limit, browser, timeout=timeout, writer=writer, thumbnails=thumbnails,
+            stream=stream, metadata=metadata, content_index=content_index, duplicates=duplicates,
+            report=report, profile=profile, scheduler=scheduler, cancel=cancel
+        )
+        if inserted is None:
+            result["status"] = "failed"
+            result["error"] = "gallery-dl failed"
+        else:
+            result["inserted"] = inserted
+    except DownloadCancelled:
+        result["status"] = "cancelled"
+        result["error"] = "stopped by the user"
+    except subprocess.TimeoutExpired:
+        result["status"] = "timeout"
+        result["error"] = f"gallery-dl exceeded {timeout}s"
+        log(f"[{username}] ⏱️ Timed out after {timeout}s")
+    except Exception as e:
+        result["status"] = "failed"
+        result["error"] = str(e)
+        log(f"[{username}] ❌ Error: {e}")
+    result["duration"] = time.monotonic() - started
+    return result
+
+
+def plan_users(users, media_type, quiet_hours=DEFAULT_QUIET_HOURS, profiles=None):
+    """Drops the users whose profile says they are quiet and orders the rest by expected job duration.
+
+    The longest jobs start first so a short one, not a long one, is the last to finish; users
+    without a recorded duration (often a first, full download) go before all others.
+    Returns (users to sync, usernames skipped).
+    """
+    profiles = profiles or get_profiles()
+    now = time.time()
+    planned = []
+    skipped = []
+    for blob, username in users:
+        if profiles.is_quiet(username, media_type, quiet_hours * 3600, now):
+            skipped.append(username)
+        else:
+            planned.append((blob, username))
+    durations = {username: profiles.expected_duration(username, media_type) for _, username in planned}
+    planned.sort(key=lambda user: float("inf") if durations[user[1]] is None else durations[user[1]], reverse=True)
+    return planned, skipped
+
+
+def run_batch(users, media_type="Posts", post_limit=DEFAULT_POST_LIMIT, browser="firefox", workers=DEFAULT_WORKERS,
+              timeout=DEFAULT_TIMEOUT, stream=True, metadata=False, duplicates=DEFAULT_DUPLICATES, profile=False,
+              launches_per_minute=DEFAULT_LAUNCHES_PER_MINUTE, post_limits=None):
+    """Syncs every (subscription_id_blob, username) pair through a bounded worker pool.
+
+    The gallery-dl downloads run concurrently while all jobs share the stages of shared_stages,
+    whose DownloadScheduler paces the launches and lowers the number that run at once while
+    Instagram throttles the session. `post_limits` maps usernames to their own post limit,
+    overriding `post_limit`. The per-user results go into the run report too. Returns the list
+    of per-user result records.
+
+    On Ctrl+C the running jobs are cancelled and the queued ones never start; both are in the
+    results with the status "cancelled".
+    """
+    with shared_stages("batch", workers, duplicates, launches_per_minute, media_type=media_type) as stages:
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+            futures = [
+                pool.submit(sync_user, blob, username, stages.writer, stages.thumbnails, media_type,
+                            (post_limits or {}).get(username, post_limit), browser, timeout, stream, metadata,
+                            stages.content_index, duplicates, stages.report, profile, stages.scheduler,
+                            stages.cancel)
+                for blob, username in users
+            ]
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                log("Stopping; cancelling the running jobs...")
+                stages.cancel.set()
+                # Python 3.8 has no shutdown(cancel_futures=True)
+                for future in futures:
+                    future.cancel()
+            stages.results = [
+                {"username": username, "status": "cancelled", "inserted": 0, "error": "never started", "duration": 0.0}
+                if future.cancelled() else future.result()
+                for future, (_, username) in zip(futures, users)
+            ]
+    return stages.results
+
+
+def print_summary(results, elapsed, skipped=()):
+    ok = [r for r in results if r["status"] == "ok"]
+    failed = [r for r in results if r["status"] != "ok"]
+    inserted = sum(r["inserted"] for r in results)
+
+    log("\n=== Batch summary ===")
+    log(f"Users: {len(results)}  OK: {len(ok)}  Failed: {len(failed)}")
+    if skipped:
+        log(f"Skipped (nothing new on their last sync): {len(skipped)}")
+    log(f"Files inserted: {inserted}")
+    log(f"Elapsed: {elapsed:.1f}s")
+    for r in sorted(failed, key=lambda r: r["username"]):
+        log(f"  ❌ {r['username']}: {r['status']} ({r['error']})")
+
+
+def parse_args(argv=None):
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Download and insert media for every subscription without the GUI.")
+    parser.add_argument("--media-type", choices=list(GDL_INCLUDE_OPTIONS.keys()),
+                        default=settings.get("media_type", "Posts"))
+    parser.add_argument("--post-limit", type=int,
+                        help="Number of latest posts per user (0 = all; default: the user's profile, then the "
+                             "saved setting)")
+    parser.add_argument("--browser", choices=("firefox", "chrome"), default=settings.get("browser", "firefox"))
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+                        help="Maximum number of concurrent gallery-dl jobs")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT,
+                        help="Per-user gallery-dl timeout in seconds (0 = no limit)")
+    parser.add_argument("--users", nargs="+", metavar="USERNAME",
+                        help="Only sync these subscriptions")
+    parser.add_argument("--no-stream", dest="stream", action="store_false",
+                        help="Wait for gallery-dl to finish before processing any file")
+    parser.add_argument("--metadata", action="store_true", default=settings.get("write_metadata", False),
+                        help="Save gallery-dl metadata and use the real post dates and owners")
+    parser.add_argument("--no-metadata", dest="metadata", action="store_false")
+    parser.add_argument("--create-file-index", action="store_true",
+                        help=f"Create an index on {MEDIA_TABLE}(file) if the database does not have one")
+    parser.add_argument("--duplicates", choices=DUPLICATE_POLICIES,
+                        default=settings.get("duplicates", DEFAULT_DUPLICATES),
+                        help="Hardlink, skip or keep files whose content is already in the library")
+    parser.add_argument("--profile", action="store_true", default=settings.get("profile", False),
+                        help="Write a cProfile dump of every job to the reports folder")
+    parser.add_argument("--launches-per-minute", type=float,
+                        default=settings.get("launches_per_minute", DEFAULT_LAUNCHES_PER_MINUTE),
+                        help="Average gallery-dl launches per minute allowed for one browser's cookies (0 = no limit)")
+    parser.add_argument("--skip-quiet-hours", type=float,
+                        default=settings.get("skip_quiet_hours", DEFAULT_QUIET_HOURS),
+                        help="Skip users whose last sync found nothing new less than this many hours ago, "
+                             "doubled for every further empty sync (0 = sync everyone)")
+    parser.add_argument("--index-existing", action="store_true",
+                        help="Hash the files of existing rows into the content index before syncing")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    db_file = find_database()
+    if not db_file or not validate_database(db_file):
+        log("❌ No valid '.stogram.sqlite' database file was found in the current directory.")
+        return 2
+
+    repository = get_repository()
+    if not repository.ensure_file_index(create=args.create_file_index):
+        log(f"⚠️ {MEDIA_TABLE}.file is not indexed; duplicate checks will scan the table "
+            "(run with --create-file-index to add one)")
+
+    if args.index_existing:
+        existing = repository.media_files()
+        log(f"⏳ Indexing the content of {len(existing)} existing files...")
+        content_index = ContentIndex(CONTENT_INDEX_FILE)
+        try:
+            log(f"Indexed {content_index.backfill(existing, log)} new files.")
+        finally:
+            content_index.close()
+
+    users = fetch_users()
+    if args.users:
+        wanted = set(args.users)
+        users = [u for u in users if u[1] in wanted]
+    if not users:
+        log("❌ No valid users found in the database.")
+        return 2
+
+    profiles = get_profiles()
+    users, skipped = plan_users(users, args.media_type, args.skip_quiet_hours, profiles)
+    if skipped:
+        log(f"Skipping {len(skipped)} users whose last sync found nothing new (--skip-quiet-hours 0 syncs them too).")
+    if args.post_limit is None:
+        default_limit = load_settings().get("post_limit", DEFAULT_POST_LIMIT)
+        post_limits = {username: profiles.post_limit(username, default_limit) for _, username in users}
+    else:
+        post_limits = None
+
+    log(f"⏳ Syncing {len(users)} users ({args.media_type}) with {args.workers} workers...")
+    started = time.monotonic()
+    results = run_batch(users, args.media_type, args.post_limit, args.browser,
+                        args.workers, args.timeout or None, args.stream, args.metadata, args.duplicates,
+                        args.profile, args.launches_per_minute, post_limits)
+    print_summary(results, time.monotonic() - started, skipped)
+    return 0 if all(r["status"] == "ok" for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,168 @@
+import hashlib
+import os
+import sqlite3
+import threading
+from pathlib import Path
+
+PARTIAL_BYTES = 64 * 1024
+CHUNK_SIZE = 1024 * 1024
+COMMIT_EVERY = 200
+BUSY_TIMEOUT_MS = 10000
+DUPLICATE_POLICIES = ("link", "skip", "keep")
+
+
+def partial_hash(path, size):
+    """Hashes the first and last 64 KiB of a file, which is enough to tell almost all media apart."""
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(PARTIAL_BYTES))
+        if size > 2 * PARTIAL_BYTES:
+            f.seek(-PARTIAL_BYTES, os.SEEK_END)
+            h.update(f.read(PARTIAL_BYTES))
+    return h.digest()
+
+
+def full_hash(path):
+    """Hashes a whole file in 1 MiB chunks so large videos are never loaded at once."""
+    h = hashlib.blake2b(digest_size=32)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            h.update(chunk)
+    return h.digest()
+
+
+def link_duplicate(existing_path, path):
+    """Replaces `path` with a hardlink to `existing_path`. Returns False if the filesystem refuses."""
+    tmp_path = Path(f"{path}.linktmp")
+    try:
+        os.link(existing_path, tmp_path)
+        os.replace(tmp_path, path)
+        return True
+    except OSError:
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+        return False
+
+
+class ContentIndex:
+    """Persistent index of media files by size and content hash, shared by all ingestion paths.
+
+    Candidates are matched on size plus a partial hash; a full hash is only computed (and then
+    cached) when two files collide on both. Entries are keyed by the `file` value of their
+    `photos` row, relative to the working directory.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._unsaved = 0
+        self.duplicates = 0
+        self.conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self.conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS hashes (
+                file TEXT PRIMARY KEY,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                partial BLOB NOT NULL,
+                full BLOB
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_hashes_size_partial ON hashes(size, partial)")
+        self.conn.commit()
+
+    def find_duplicate(self, path, file):
+        """Returns the `file` of an indexed entry with the same bytes as `path`, or None.
+
+        `path` may lie outside the library (a manual import); its hashes are kept for the
+        following add() of `file`, so they are computed only once.
+        """
+        size = os.stat(path).st_size
+        partial = partial_hash(path, size)
+        with self._lock:
+            candidates = self.conn.execute(
+                "SELECT file, full FROM hashes WHERE size = ? AND partial = ? AND file != ?",
+                (size, partial, file)
+            ).fetchall()
+        own_full = None
+        duplicate = None
+        for candidate, candidate_full in candidates:
+            if not Path(candidate).is_file():
+                self.remove(candidate)
+                continue
+            if own_full is None:
+                own_full = full_hash(path)
+            if candidate_full is None:
+                candidate_full = full_hash(candidate)
+                with self._lock:
+                    self.conn.execute("UPDATE hashes SET full = ? WHERE file = ?", (candidate_full, candidate))
+            if candidate_full == own_full:
+                duplicate = candidate
+                break
+        with self._lock:
+            self._pending[file] = (size, partial, own_full)
+            if duplicate:
+                self.duplicates += 1
+        return duplicate
+
+    def add(self, file, path):
+        """Indexes `path` under the `file` value of its row, reusing hashes from find_duplicate."""
+        stat = os.stat(path)
+        with self._lock:
+            pending = self._pending.pop(file, None)
+        if pending is None or pending[0] != stat.st_size:
+            pending = (stat.st_size, partial_hash(path, stat.st_size), None)
+        size, partial, full = pending
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO hashes VALUES (?, ?, ?, ?, ?)",
+                              (file, size, stat.st_mtime_ns, partial, full))
+            self._unsaved += 1
+            if self._unsaved >= COMMIT_EVERY:
+                self.conn.commit()
+                self._unsaved = 0
+
+    def discard(self, file):
+        """Forgets the hashes find_duplicate kept for a file that is not going to be added."""
+        with self._lock:
+            self._pending.pop(file, None)
+
+    def remove(self, file):
+        with self._lock:
+            self.conn.execute("DELETE FROM hashes WHERE file = ?", (file,))
+
+    def backfill(self, files, output_callback=None):
+        """Indexes existing library files that are not in the index yet. Returns the number added."""
+        with self._lock:
+            indexed = {row[0] for row in self.conn.execute("SELECT file FROM hashes")}
+        added = 0
+        for file in files:
+            if file in indexed or not Path(file).is_file():
+                continue
+            try:
+                self.add(file, file)
+            except OSError:
+                continue
+            added += 1
+            if output_callback and added % 1000 == 0:
+                output_callback(f"Indexed {added} existing files...")
+        self.flush()
+        return added
+
+    def flush(self):
+        with self._lock:
+            self.conn.commit()
+            self._unsaved = 0
+
+    def close(self):
+        self.flush()
+        self.conn.close()
+
+    def summary(self):
+        with self._lock:
+            entries = self.conn.execute("SELECT COUNT(*) FROM hashes").fetchone()[0]
+        return f"Content index: {entries} files, {self.duplicates} duplicates found"
@@ -0,0 +1,299 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from pathlib import Path
+
+from downloader import (
+    DATA_DIR, GDL_INCLUDE_OPTIONS, DEFAULT_DUPLICATES, fetch_users, find_database, validate_database, load_settings,
+    get_profiles
+)
+from content_index import DUPLICATE_POLICIES
+from ratelimit import DEFAULT_LAUNCHES_PER_MINUTE
+from state_store import MAX_QUIET_DOUBLINGS
+from telemetry import write_json
+from batch import log, sync_user, shared_stages, DEFAULT_TIMEOUT, DEFAULT_POST_LIMIT
+
+# === DEFAULT SCHEDULE VALUES ===
+STATE_FILE = DATA_DIR / "daemon_state.json"
+DEFAULT_INTERVAL = 12 * 3600
+DEFAULT_INTERVALS = {"Stories": 3 * 3600}
+DEFAULT_MEDIA_TYPES = ["Posts", "Stories"]
+DEFAULT_JITTER = 0.1
+DEFAULT_MIN_SPACING = 30
+DEFAULT_INITIAL_SPREAD = 10 * 60
+BACKOFF_BASE = 10 * 60
+BACKOFF_MAX = 24 * 3600
+REFRESH_INTERVAL = 3600
+POLL_INTERVAL = 1.0
+
+
+class Scheduler:
+    """Runs every (subscription, media type) entry on its own interval.
+
+    Entries that have never run are spread over `initial_spread` seconds, launches are at least
+    `min_spacing` seconds apart, every next run is jittered, and failures back off exponentially.
+    After a run that found nothing new the interval doubles, up to `quiet_doublings` times in a row.
+    When more entries are due than there are free workers, the one with the highest
+    `expected_cost(entry)` (None counts as highest) starts first.
+    The schedule is persisted to `state_file` after each job so a restart resumes it. The clock,
+    sleep function (default: wait on the stop event) and job runner are injectable for tests.
+    `run_job(entry)` returns whether the run succeeded, or (succeeded, found nothing new).
+    On Ctrl+C no further jobs start and `on_stop()` is called to cancel the running ones; their
+    outcomes are still recorded before `run` returns.
+    """
+
+    def __init__(self, load_entries, run_job, state_file=STATE_FILE, intervals=None, default_interval=DEFAULT_INTERVAL,
+                 workers=1, jitter=DEFAULT_JITTER, min_spacing=DEFAULT_MIN_SPACING,
+                 initial_spread=DEFAULT_INITIAL_SPREAD, backoff_base=BACKOFF_BASE, backoff_max=BACKOFF_MAX,
+                 refresh_interval=REFRESH_INTERVAL, quiet_doublings=MAX_QUIET_DOUBLINGS, expected_cost=None,
+                 on_stop=None, clock=time.time, sleep=None, rng=None):
+        self.load_entries = load_entries
+        self.run_job = run_job
+        self.state_file = Path(state_file)
+        self.intervals = dict(DEFAULT_INTERVALS if intervals is None else intervals)
+        self.default_interval = default_interval
+        self.workers = max(1, workers)
+        self.jitter = jitter
+        self.min_spacing = min_spacing
+        self.initial_spread = initial_spread
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.refresh_interval = refresh_interval
+        self.quiet_doublings = quiet_doublings
+        self.expected_cost = expected_cost
+        self.on_stop = on_stop
+        self.clock = clock
+        self.sleep = sleep
+        self.rng = rng or random.Random()
+        self.entries = {}
+        self.state = self._load_state()
+        self.last_launch = None
+        self.last_refresh = None
+
+    @staticmethod
+    def key_for(username, media_type):
+        return f"{username}:{media_type}"
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def save_state(self):
+        write_json(self.state_file, self.state)
+
+    def interval_for(self, media_type):
+        return self.intervals.get(media_type, self.default_interval)
+
+    def _jittered(self, seconds):
+        return seconds * (1 + self.rng.uniform(-self.jitter, self.jitter))
+
+    def refresh(self):
+        """Reloads the entries; new ones are scheduled within the initial spread window."""
+        now = self.clock()
+        self.entries = {}
+        added = False
+        for entry in self.load_entries():
+            subscription_id_blob, username, media_type = entry
+            key = self.key_for(username, media_type)
+            self.entries[key] = entry
+            if key not in self.state:
+                self.state[key] = {
+                    "last_success": None,
+                    "failures": 0,
+                    "next_due": now + self.rng.uniform(0, self.initial_spread),
+                }
+                added = True
+        self.last_refresh = now
+        if added:
+            self.save_state()
+
+    def record(self, key, ok, quiet=False):
+        """Updates the schedule of one entry after a run and persists it."""
+        now = self.clock()
+        state = self.state[key]
+        state["last_attempt"] = now
+        if ok:
+            state["last_success"] = now
+            state["failures"] = 0
+            state["quiet_runs"] = state.get("quiet_runs", 0) + 1 if quiet else 0
+            media_type = self.entries[key][2] if key in self.entries else None
+            stretch = 2 ** min(state["quiet_runs"], self.quiet_doublings)
+            state["next_due"] = now + self._jittered(self.interval_for(media_type) * stretch)
+        else:
+            state["failures"] = state.get("failures", 0) + 1
+            delay = min(self.backoff_base * 2 ** (state["failures"] - 1), self.backoff_max)
+            state["next_due"] = now + self._jittered(delay)
+        self.save_state()
+
+    def due(self, now):
+        keys = sorted((k for k in self.entries if self.state[k]["next_due"] <= now),
+                      key=lambda k: self.state[k]["next_due"])
+        if self.expected_cost is None:
+            return keys
+        costs = {k: self.expected_cost(self.entries[k]) for k in keys}
+        # Stable, so entries of equal cost keep their due order
+        return sorted(keys, key=lambda k: float("inf") if costs[k] is None else costs[k], reverse=True)
+
+    @staticmethod
+    def _outcome(result):
+        if isinstance(result, tuple):
+            return bool(result[0]), bool(result[1])
+        return bool(result), False
+
+    def _next_wakeup(self, now, running):
+        wakeups = [self.last_refresh + self.refresh_interval]
+        if running:
+            wakeups.append(now + POLL_INTERVAL)
+        if len(running) < self.workers:
+            pending = [self.state[k]["next_due"] for k in self.entries if k not in running.values()]
+            if pending:
+                launch_at = min(pending)
+                if self.last_launch is not None:
+                    launch_at = max(launch_at, self.last_launch + self.min_spacing)
+                wakeups.append(launch_at)
+        return max(now, min(wakeups))
+
+    def run(self, stop=None, max_iterations=None):
+        """Loops until `stop` is set (or `max_iterations` passes), then waits for running jobs."""
+        stop = stop or threading.Event()
+        sleep = self.sleep or stop.wait
+        running = {}
+        iterations = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            try:
+                while not stop.is_set() and (max_iterations is None or iterations < max_iterations):
+                    iterations += 1
+                    now = self.clock()
+                    if self.last_refresh is None or now - self.last_refresh >= self.refresh_interval:
+                        self.refresh()
+
+                    for future in [f for f in running if f.done()]:
+                        key = running.pop(future)
+                        try:
+                            ok, quiet = self._outcome(future.result())
+                        except Exception as e:
+                            log(f"[{key}] ❌ Error: {e}")
+                            ok, quiet = False, False
+                        self.record(key, ok, quiet)
+
+                    for key in self.due(now):
+                        if len(running) >= self.workers:
+                            break
+                        if key in running.values():
+                            continue
+                        if self.last_launch is not None and now - self.last_launch < self.min_spacing:
+                            break
+                        running[pool.submit(self.run_job, self.entries[key])] = key
+                        self.last_launch = now
+
+                    wakeup = self._next_wakeup(now, running)
+                    if running:
+                        # Wake as soon as a job finishes instead of polling on the clock
+                        wait(running, timeout=wakeup - now, return_when=FIRST_COMPLETED)
+                    elif wakeup > now:
+                        sleep(wakeup - now)
+            except KeyboardInterrupt:
+                log("Stopping; cancelling the running jobs...")
+                stop.set()
+                if self.on_stop is not None:
+                    self.on_stop()
+
+            for future, key in running.items():
+                try:
+                    ok, quiet = self._outcome(future.result())
+                except Exception:
+                    ok, quiet = False, False
+                self.record(key, ok, quiet)
+
+
+def build_entries(media_types=None, profiles=None):
+    """One entry per user and media type, by default those of the user's profile or else DEFAULT_MEDIA_TYPES."""
+    profiles = profiles or get_profiles()
+    return [
+        (blob, username, media_type)
+        for blob, username in fetch_users()
+        for media_type in media_types or profiles.media_types(username) or DEFAULT_MEDIA_TYPES
+    ]
+
+
+def parse_args(argv=None):
+    settings = load_settings()
+    parser = argparse.ArgumentParser(description="Keep every subscription in sync on a schedule.")
+    parser.add_argument("--media-types", nargs="+", choices=list(GDL_INCLUDE_OPTIONS.keys()),
+                        help="Default: each user's profile, then " + " ".join(DEFAULT_MEDIA_TYPES))
+    parser.add_argument("--post-limit", type=int,
+                        help="Default: the user's profile, then the saved setting")
+    parser.add_argument("--browser", choices=("firefox", "chrome"), default=settings.get("browser", "firefox"))
+    parser.add_argument("--workers", type=int, default=1, help="Maximum number of concurrent gallery-dl jobs")
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT,
+                        help="Per-job gallery-dl timeout in seconds (0 = no limit)")
+    parser.add_argument("--interval", type=int, default=DEFAULT_INTERVAL,
+                        help="Seconds between syncs of one user")
+    parser.add_argument("--stories-interval", type=int, default=DEFAULT_INTERVALS["Stories"],
+                        help="Seconds between story syncs of one user")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_JITTER,
+                        help="Random fraction added to or removed from every interval")
+    parser.add_argument("--min-spacing", type=int, default=DEFAULT_MIN_SPACING,
+                        help="Minimum seconds between two gallery-dl launches")
+    parser.add_argument("--launches-per-minute", type=float,
+                        default=settings.get("launches_per_minute", DEFAULT_LAUNCHES_PER_MINUTE),
+                        help="Average gallery-dl launches per minute allowed for one browser's cookies (0 = no limit)")
+    parser.add_argument("--max-quiet-doublings", type=int, default=MAX_QUIET_DOUBLINGS,
+                        help="How many times in a row the interval doubles after syncs that found nothing new")
+    parser.add_argument("--initial-spread", type=int, default=DEFAULT_INITIAL_SPREAD,
+                        help="Seconds over which first syncs of new subscriptions are spread")
+    parser.add_argument("--metadata", action="store_true", default=settings.get("write_metadata", False))
+    parser.add_argument("--duplicates", choices=DUPLICATE_POLICIES,
+                        default=settings.get("duplicates", DEFAULT_DUPLICATES),
+                        help="Hardlink, skip or keep files whose content is already in the library")
+    parser.add_argument("--profile", action="store_true", default=settings.get("profile", False),
+                        help="Write a cProfile dump of every job to the reports folder")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    db_file = find_database()
+    if not db_file or not validate_database(db_file):
+        log("❌ No valid '.stogram.sqlite' database file was found in the current directory.")
+        return 2
+
+    profiles = get_profiles()
+    default_limit = load_settings().get("post_limit", DEFAULT_POST_LIMIT)
+    with shared_stages("watch", args.workers, args.duplicates, args.launches_per_minute) as stages:
+        def run_job(entry):
+            subscription_id_blob, username, media_type = entry
+            post_limit = args.post_limit if args.post_limit is not None else \
+                profiles.post_limit(username, default_limit)
+            result = sync_user(subscription_id_blob, username, stages.writer, stages.thumbnails, media_type,
+                               post_limit, args.browser, args.timeout or None, metadata=args.metadata,
+                               content_index=stages.content_index, duplicates=args.duplicates,
+                               report=stages.report, profile=args.profile, scheduler=stages.scheduler,
+                               cancel=stages.cancel)
+            log(f"[{username}] {media_type}: {result['status']}, {result['inserted']} new "
+                f"in {result['duration']:.0f}s")
+            return result["status"] == "ok", result["inserted"] == 0
+
+        scheduler = Scheduler(
+            lambda: build_entries(args.media_types, profiles), run_job,
+            intervals={"Stories": args.stories_interval}, default_interval=args.interval,
+            workers=args.workers, jitter=args.jitter, min_spacing=args.min_spacing,
+            initial_spread=args.initial_spread, quiet_doublings=args.max_quiet_doublings,
+            expected_cost=lambda entry: profiles.expected_duration(entry[1], entry[2]), on_stop=stages.cancel.set
+        )
+        media_types = ", ".join(args.media_types) if args.media_types else "media types from the user profiles"
+        log(f"⏳ Watching subscriptions ({media_types}); press Ctrl+C to stop.")
+        scheduler.run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,783 @@
+import os
+import re
+import signal
+import subprocess
+import time
+import sqlite3
+import threading
+import queue
+import json
+import cProfile
+from collections import deque
+from concurrent.futures import wait
+from datetime import datetime, timezone
+from pathlib import Path
+from ingest import DatabaseWriter, MediaRecord
+from repository import StogramRepository
+from telemetry import StageReport, append_jsonl, write_json
+from thumbnails import ThumbnailStage, needs_thumbnail, thumbnail_name
+from scanner import FolderScanner, MEDIA_EXTENSIONS
+from content_index import ContentIndex, link_duplicate
+from journal import JobJournal
+from state_store import JsonStore, UserProfiles
+from ratelimit import classify, is_limit_signal
+from importer import DEFAULT_IMPORT_STRATEGY, plan_destinations, transfer_files
+
+# === DEFAULT CONFIG VALUES ===
+MEDIA_TABLE = "photos"
+SUBSCRIPTIONS_TABLE = "subscriptions"
+MEDIA_BASE_PATH = Path("instagram")
+THUMBNAIL_FOLDER_NAME = "thumbnails"
+FFMPEG_EXE = "assets/ffmpeg.exe"
+GDL_EXE = "assets/gallery-dl.exe"
+SETTINGS_FILE = "settings.json"
+JOURNAL_FILE = Path(SETTINGS_FILE).with_name("job_journal.sqlite")
+DATA_DIR = Path("downloader_data")
+SCAN_MANIFEST_DIR = DATA_DIR / "scans"
+ARCHIVE_DIR = DATA_DIR / "archives"
+CONTENT_INDEX_FILE = DATA_DIR / "content_index.sqlite"
+REPORT_DIR = DATA_DIR / "reports"
+USERS_CACHE_FILE = DATA_DIR / "users_cache.json"
+PROFILES_FILE = DATA_DIR / "user_profiles.json"
+JOB_REPORT_FILE = REPORT_DIR / "jobs.jsonl"
+# What to do with a file whose bytes are already in the library: "link", "skip" or "keep"
+DEFAULT_DUPLICATES = "link"
+# Lines of gallery-dl's stderr kept for error messages and throttling detection
+GDL_STDERR_TAIL = 20
+GDL_POLL_SECONDS = 0.25
+# How long to wait for gallery-dl's pipes to close after it was killed before giving up on them
+GDL_PIPE_DRAIN_SECONDS = 2.0
+METADATA_FOLDER_NAME = "metadata"
+# Written on "prepare" so the JSON already exists when gallery-dl reports the file
+GDL_METADATA_POSTPROCESSORS = json.dumps([{"name": "metadata", "event": "prepare", "directory": METADATA_FOLDER_NAME}])
+
+# The .stogram.sqlite database in the current directory, found by find_database() on first use
+DB_FILE = None
+
+GDL_INCLUDE_OPTIONS = {
+    "All": "all",
+    "All (except Tagged)": "posts,stories,highlights,reels,avatar",
+    "Posts": "posts",
+    "Stories": "stories",
+    "Highlights": "highlights",
+    "Reels": "reels",
+    "Avatar": "avatar",
+    "Tagged": "tagged"
+}
+
+_repository = None
+_repository_lock = threading.Lock()
+_journal = None
+_settings_store = None
+_profiles = None
+
+def find_database(folder="."):
+    """Returns the first '.stogram.sqlite' file in `folder`, looked up once and kept in DB_FILE."""
+    global DB_FILE
+    if DB_FILE is None:
+        with os.scandir(folder) as entries:
+            for entry in entries:
+                if entry.name.endswith(".stogram.sqlite") and entry.is_file():
+                    DB_FILE = Path(folder) / entry.name
+                    break
+    return DB_FILE
+
+def get_repository():
+    """Returns the repository of DB_FILE shared by every job, opening it on first use."""
+    global _repository
+    db_file = find_database()
+    with _repository_lock:
+        if _repository is None:
+            _repository = StogramRepository(db_file, MEDIA_TABLE, SUBSCRIPTIONS_TABLE)
+        return _repository
+
+def close_repository():
+    """Closes the shared repository; the next get_repository() reopens it."""
+    global _repository
+    with _repository_lock:
+        if _repository is not None:
+            _repository.close()
+            _repository = None
+
+def get_journal():
+    """Returns the job journal shared by every job, opening it on first use."""
+    global _journal
+    with _repository_lock:
+        if _journal is None:
+            _journal = JobJournal(JOURNAL_FILE)
+        return _journal
+
+def close_journal():
+    """Prunes finished entries and closes the shared journal; the next get_journal() reopens it."""
+    global _journal
+    with _repository_lock:
+        if _journal is not None:
+            _journal.close()
+            _journal = None
+
+def get_settings_store():
+    """Returns the store of SETTINGS_FILE shared by the app, reading the file on first use."""
+    global _settings_store
+    with _repository_lock:
+        if _settings_store is None:
+            _settings_store = JsonStore(SETTINGS_FILE)
+        return _settings_store
+
+def get_profiles():
+    """Returns the per-user profiles shared by every job, reading PROFILES_FILE on first use."""
+    global _profiles
+    with _repository_lock:
+        if _profiles is None:
+            _profiles = UserProfiles(PROFILES_FILE)
+        return _profiles
+
+def database_signature(db_file):
+    """mtime and size of the database and its WAL file; every committed write changes one of them."""
+    signature = []
+    for path in (str(db_file), f"{db_file}-wal"):
+        try:
+            stat = os.stat(path)
+            signature += [stat.st_mtime_ns, stat.st_size]
+        except OSError:
+            signature += [None, None]
+    return signature
+
+def cached_users():
+    """Returns the user list saved by fetch_users, or None if the database changed since."""
+    try:
+        with open(USERS_CACHE_FILE, "r", encoding="utf-8") as f:
+            cache = json.load(f)
+        if cache["database"] != str(DB_FILE) or cache["signature"] != database_signature(DB_FILE):
+            return None
+        return [(bytes.fromhex(subscription_id), username) for subscription_id, username in cache["users"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def fetch_users():
+    """Reads the subscriptions from the database and saves them for cached_users."""
+    # Taken before the query, so a write that lands during it invalidates the cache
+    signature = database_signature(DB_FILE)
+    try:
+        users = get_repository().list_subscriptions()
+    except sqlite3.Error:
+        return []
+    # Subscription IDs are BLOBs in 4K Stogram databases; anything else is simply not cached
+    if all(isinstance(subscription_id, bytes) for subscription_id, _ in users):
+        try:
+            write_json(USERS_CACHE_FILE, {
+                "database": str(DB_FILE),
+                "signature": signature,
+                "users": [(subscription_id.hex(), username) for subscription_id, username in users],
+            })
+        except OSError:
+            pass
+    return users
+
+def validate_database(file_path):
+    # sqlite3 would silently create a missing file
+    if not file_path or not Path(file_path).is_file():
+        return False
+    if file_path == DB_FILE:
+        return get_repository().is_valid()
+    repository = StogramRepository(file_path, MEDIA_TABLE, SUBSCRIPTIONS_TABLE)
+    try:
+        return repository.is_valid()
+    finally:
+        repository.close()
+
+class DownloadCancelled(Exception):
+    """Raised when a running download is cancelled through its cancel event."""
+
+# gallery-dl gets a process group of its own, so killing it also kills anything it started
+if os.name == "nt":
+    NEW_PROCESS_GROUP = {"creationflags": subprocess.CREATE_NEW_PROCESS_GROUP}
+else:
+    NEW_PROCESS_GROUP = {"start_new_session": True}
+
+def kill_process_tree(proc):
+    """Kills a process started with NEW_PROCESS_GROUP and every process it started."""
+    if os.name == "nt":
+        if proc.poll() is None:
+            subprocess.run(["taskkill", "/T", "/F", "/PID", str(proc.pid)],
+                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        if proc.poll() is None:
+            proc.kill()
+        return
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except OSError:
+        # The whole group has exited already
+        pass
+
+def run_gallery_dl(command, on_path, timeout=None, cancel=None):
+    """Runs gallery-dl and calls `on_path` for every file path it reports, as soon as it is reported.
+
+    gallery-dl prints one path per downloaded file and "# path" for files that already existed.
+    Returns the notable part of its stderr: every throttling or checkpoint message plus the last
+    GDL_STDERR_TAIL lines. Raises subprocess.CalledProcessError (with that text as `stderr`) on
+    failure, subprocess.TimeoutExpired after `timeout` seconds and DownloadCancelled once the
+    `cancel` event is set.
+    """
+    env = dict(os.environ, PYTHONIOENCODING="utf-8")
+    proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env, encoding="utf-8",
+                            errors="replace", **NEW_PROCESS_GROUP)
+    signals = []
+    tail = deque(maxlen=GDL_STDERR_TAIL)
+    lines = queue.Queue()
+
+    def read_stdout():
+        try:
+            for line in proc.stdout:
+                lines.put(line)
+        finally:
+            lines.put(None)
+
+    def read_stderr():
+        for line in proc.stderr:
+            line = line.rstrip()
+            if is_limit_signal(line) and len(signals) < GDL_STDERR_TAIL:
+                signals.append(line)
+            tail.append(line)
+
+    # The pipes are read on threads so a process that keeps them open cannot block this one
+    readers = [threading.Thread(target=read_stdout, daemon=True), threading.Thread(target=read_stderr, daemon=True)]
+    for reader in readers:
+        reader.start()
+    finished = threading.Event()
+    stopped = []
+    deadline = time.monotonic() + timeout if timeout else None
+
+    def watchdog():
+        while not finished.wait(GDL_POLL_SECONDS):
+            if cancel is not None and cancel.is_set():
+                stopped.append("cancelled")
+            elif deadline is not None and time.monotonic() >= deadline:
+                stopped.append("timeout")
+            else:
+                continue
+            kill_process_tree(proc)
+            return
+
+    if deadline is not None or cancel is not None:
+        threading.Thread(target=watchdog, daemon=True).start()
+    try:
+        while not stopped:
+            try:
+                line = lines.get(timeout=GDL_POLL_SECONDS)
+            except queue.Empty:
+                continue
+            if line is None:
+                break
+            path = line.strip()
+            if path.startswith("# "):
+                path = path[2:]
+            if path:
+                on_path(Path(path))
+        returncode = proc.wait()
+    finally:
+        finished.set()
+        if stopped or proc.poll() is None:
+            kill_process_tree(proc)
+        proc.wait()
+        for reader in readers:
+            reader.join(GDL_PIPE_DRAIN_SECONDS)
+        if not any(reader.is_alive() for reader in readers):
+            proc.stdout.close()
+            proc.stderr.close()
+
+    stderr = "\n".join(signals + [line for line in tail if line not in signals])
+    if "cancelled" in stopped:
+        raise DownloadCancelled()
+    if "timeout" in stopped:
+        raise subprocess.TimeoutExpired(command, timeout, stderr=stderr)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command, stderr=stderr)
+    return stderr
+
+def read_gdl_metadata(user_media_path, filename):
+    """Returns (created_time, owner_id) from gallery-dl's metadata file for `filename`; missing values are None."""
+    try:
+        with open(user_media_path / METADATA_FOLDER_NAME / f"{filename}.json", "r", encoding="utf-8") as f:
+            data = json.load(f)
+    except (OSError, ValueError):
+        return None, None
+
+    created_time = None
+    try:
+        date = datetime.strptime(str(data["date"]), "%Y-%m-%d %H:%M:%S")
+        created_time = int(date.replace(tzinfo=timezone.utc).timestamp())
+    except (KeyError, ValueError):
+        pass
+
+    owner_id = data.get("owner_id")
+    if isinstance(owner_id, str) and owner_id.isdigit():
+        owner_id = int(owner_id)
+    return created_time, owner_id
+
+def download_media(subscription_id_blob, username, output_callback, media_type="Posts", post_limit=10, browser="firefox",
+                   timeout=None, writer=None, thumbnails=None, stream=True, metadata=False, progress_callback=None,
+                   cancel=None, content_index=None, duplicates=DEFAULT_DUPLICATES, report=None, profile=False,
+                   scheduler=None):
+    """Downloads media for one user and queues the new files for insertion.
+
+    Returns the number of queued rows, or None if gallery-dl failed. A gallery-dl run longer than
+    `timeout` seconds is killed and raises subprocess.TimeoutExpired. Inserts go through `writer`
+    and ffmpeg runs through `thumbnails` when given, so concurrent jobs share both stages.
+    With `stream` set, every file gallery-dl reports is thumbnailed and inserted while the
+    download is still running; a final folder scan picks up anything it did not report.
+    A per-user download archive makes re-runs skip items fetched before, and with `metadata`
+    set the real post date and owner are read from gallery-dl's JSON metadata.
+    `progress_callback(done, total)` is called for every processed file; `total` is None until
+    the final scan has counted the remaining files. Setting the `cancel` event stops the job
+    with DownloadCancelled; files already queued are still written.
+    New files are looked up by content in `content_index`: with `duplicates` set to "link" a
+    copy of a file another row already uses is replaced by a hardlink to it, with "skip" it gets
+    no row, and "keep" turns the lookup off.
+    Per-stage timings and counters of the job are appended to JOB_REPORT_FILE and merged into
+    `report` when given; with `profile` set, a cProfile dump of the job is written next to it.
+    Every new file is tracked in the job journal until its row is committed; the journal registers
+    itself with the writer, passed-in or not. resume_journal finishes whatever an interrupted run
+    left behind.
+    With a `scheduler` (a DownloadScheduler shared by the jobs) gallery-dl only starts once the
+    scheduler allows another launch for the `browser` cookies, and each run's outcome (throttled,
+    checkpoint, ...) is reported back to it.
+    The job's outcome, duration and newest item are added to the user's profile (get_profiles()),
+    which batch and watch mode use to skip quiet users and start the longest jobs first.
+    """
+    job_report = StageReport(
+        run_id=report.info.get("run_id") if report is not None else None, username=username, media_type=media_type
+    )
+    profiler = cProfile.Profile() if profile else None
+    status = "error"
+    inserted = None
+    try:
+        if profiler:
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows only one active profiler; parallel jobs go unprofiled
+                output_callback("⚠️ Another job is being profiled; this one is not.")
+                profiler = None
+        inserted = _download_media(
+            subscription_id_blob, username, output_callback, media_type=media_type, post_limit=post_limit,
+            browser=browser, timeout=timeout, writer=writer, thumbnails=thumbnails, stream=stream, metadata=metadata,
+            progress_callback=progress_callback, cancel=cancel, content_index=content_index, duplicates=duplicates,
+            job_report=job_report, scheduler=scheduler
+        )
+        status = "ok" if inserted is not None else "failed"
+        return inserted
+    except DownloadCancelled:
+        status = "cancelled"
+        raise
+    except subprocess.TimeoutExpired:
+        status = "timeout"
+        raise
+    finally:
+        job_report.info["status"] = status
+        try:
+            get_profiles().record_sync(username, media_type, status, inserted or 0,
+                                       time.time() - job_report.started, job_report.info.get("last_item"))
+        except OSError as e:
+            output_callback(f"⚠️ Could not update the profile of @{username}: {e}")
+        try:
+            if profiler:
+                profiler.disable()
+                REPORT_DIR.mkdir(parents=True, exist_ok=True)
+                safe_type = re.sub(r"\W+", "_", media_type)
+                profiler.dump_stats(str(REPORT_DIR / f"{username}-{safe_type}-{int(job_report.started)}.prof"))
+            append_jsonl(JOB_REPORT_FILE, job_report.to_dict())
+        except OSError as e:
+            output_callback(f"⚠️ Could not write the job report: {e}")
+        if report is not None:
+            report.merge(job_report)
+
+
+def _download_media(subscription_id_blob, username, output_callback, *, media_type, post_limit, browser, timeout,
+                    writer, thumbnails, stream, metadata, progress_callback, cancel, content_index, duplicates,
+                    job_report, scheduler):
+    """The download_media pipeline; every stage records into `job_report`."""
+    user_media_path = MEDIA_BASE_PATH / username
+    user_thumb_path = user_media_path / THUMBNAIL_FOLDER_NAME
+    user_media_path.mkdir(parents=True, exist_ok=True)
+    user_thumb_path.mkdir(parents=True, exist_ok=True)
+
+    if media_type == "Stories":
+        url = f"https://www.instagram.com/stories/{username}/"
+    else:
+        url = f"https://www.instagram.com/{username}/"
+
+    command = [
+        GDL_EXE,
+        url,
+        "--cookies-from-browser", browser,
+        "-o", f"include={GDL_INCLUDE_OPTIONS[media_type]}",
+        "-o", f"extractor.instagram.max-posts={post_limit}",
+        "--download-archive", str(ARCHIVE_DIR / f"{username}.sqlite3"),
+        "-D", str(user_media_path)
+    ]
+    if metadata:
+        command += ["-o", f"postprocessors={GDL_METADATA_POSTPROCESSORS}"]
+    ARCHIVE_DIR.mkdir(parents=True, exist_ok=True)
+
+    # Read everything we need up front so the shared reader is never held while downloads and ffmpeg run
+    repository = get_repository()
+    journal = get_journal()
+    with job_report.stage("db_lookup"):
+        owner_id = repository.owner_id_for(username)
+        known_files = repository.known_files(subscription_id_blob)
+
+    created_time = int(time.time())
+    scanner = FolderScanner(user_media_path, SCAN_MANIFEST_DIR / f"{username}.json")
+
+    own_thumbnails = thumbnails is None
+    if own_thumbnails:
+        thumbnails = ThumbnailStage(FFMPEG_EXE)
+    own_writer = writer is None
+    if own_writer:
+        writer = DatabaseWriter(repository, report=job_report).start()
+    writer.add_on_written(journal.mark_inserted)
+    if duplicates == "keep":
+        content_index = None
+    own_content_index = content_index is None and duplicates != "keep"
+    if own_content_index:
+        content_index = ContentIndex(CONTENT_INDEX_FILE)
+
+    pending = []
+    handled = set()
+    inserted = 0
+    progress_lock = threading.Lock()
+    processed = 0
+    total = None
+
+    def advance():
+        nonlocal processed
+        with progress_lock:
+            processed += 1
+            if progress_callback:
+                progress_callback(processed, total)
+
+    def queue_insert(filename, record):
+        writer.insert(record)
+        job_report.count("rows_queued")
+        output_callback(f"Inserted: {filename}")
+        advance()
+
+    def thumbnailed(filename, record, ok):
+        # Without a thumbnail the row points at the media itself rather than at a missing file
+        if not ok:
+            record = record._replace(thumbnail_file=record.file)
+        journal.mark_thumbnailed(record.file, record.thumbnail_file)
+        queue_insert(filename, record)
+
+    def is_new(filename, full_path, file_relative_path):
+        """Runs the dedupe checks for one file; returns False if it must not get a row."""
+        if file_relative_path in known_files:
+            output_callback(f"Skipping existing: {filename}")
+            job_report.count("skipped_existing")
+            return False
+        known_files.add(file_relative_path)
+
+        if content_index is not None:
+            duplicate = content_index.find_duplicate(full_path, file_relative_path)
+            if duplicate and duplicates == "skip":
+                content_index.discard(file_relative_path)
+                output_callback(f"Skipping duplicate of {duplicate}: {filename}")
+                job_report.count("duplicates_skipped")
+                return False
+            if duplicate and link_duplicate(duplicate, full_path):
+                output_callback(f"Linked duplicate of {duplicate}: {filename}")
+                job_report.count("duplicates_linked")
+            content_index.add(file_relative_path, full_path)
+        return True
+
+    def ingest(filename, reported=False):
+        nonlocal inserted
+        if filename in handled:
+            return
+        handled.add(filename)
+        job_report.count("files_seen")
+        full_path = user_media_path / filename
+        file_relative_path = str(full_path.relative_to(MEDIA_BASE_PATH.parent))
+
+        with job_report.stage("dedupe"):
+            new = is_new(filename, full_path, file_relative_path)
+        if not new:
+            advance()
+            return
+        inserted += 1
+        if reported:
+            # gallery-dl goes newest first, so the first new file it reports is the user's latest item
+            job_report.info.setdefault("last_item", Path(filename).stem)
+
+        post_time, post_owner_id = read_gdl_metadata(user_media_path, filename) if metadata else (None, None)
+        record = MediaRecord(
+            subscription_id_blob,
+            post_time or created_time,
+            file_relative_path,
+            file_relative_path,
+            username,
+            post_owner_id or owner_id
+        )
+        if needs_thumbnail(full_path):
+            thumb_path = user_thumb_path / thumbnail_name(filename)
+            record = record._replace(thumbnail_file=str(thumb_path.relative_to(MEDIA_BASE_PATH.parent)))
+            journal.add(record, "downloaded")
+            pending.append(thumbnails.submit(
+                full_path, thumb_path, output_callback,
+                then=lambda ok: thumbnailed(filename, record, ok),
+                report=job_report
+            ))
+        else:
+            journal.add(record, "thumbnailed")
+            queue_insert(filename, record)
+
+    def on_path(path):
+        if path.suffix.lower() in MEDIA_EXTENSIONS and (user_media_path / path.name).is_file():
+            ingest(path.name, reported=True)
+
+    def launch():
+        """Runs gallery-dl in a scheduler slot and reports its outcome; returns False if it failed."""
+        if scheduler is not None:
+            with job_report.stage("launch_wait"):
+                if not scheduler.acquire(browser, cancel):
+                    raise DownloadCancelled()
+        outcome = "cancelled"
+        try:
+            # In stream mode this also covers the files ingested while gallery-dl runs
+            with job_report.stage("gallery_dl"):
+                stderr = run_gallery_dl(command, on_path if stream else lambda path: None, timeout, cancel)
+            outcome = classify(0, stderr)
+            return True
+        except subprocess.CalledProcessError as e:
+            outcome = classify(e.returncode, e.stderr or "")
+            last_line = e.stderr.splitlines()[-1] if e.stderr else ""
+            output_callback(f"❌ gallery-dl failed: {e}" + (f" ({last_line})" if last_line else ""))
+            return False
+        except subprocess.TimeoutExpired:
+            outcome = "failed"
+            raise
+        finally:
+            job_report.count(f"gallery_dl_{outcome}")
+            if scheduler is not None:
+                pause = scheduler.release(browser, outcome)
+                if pause:
+                    output_callback(f"⏸️ Instagram reported {outcome} for the {browser} session; "
+                                    f"no new downloads with it for {pause:.0f}s")
+
+    try:
+        output_callback(f"Downloading {media_type.lower()} from Instagram for @{username} using {browser} cookies...")
+        if not launch():
+            return None
+
+        output_callback(f"Scanning for new media in {user_media_path}...")
+        with job_report.stage("scan"):
+            remaining = [f for f in scanner.scan() if f not in handled]
+        with progress_lock:
+            total = len(handled) + len(remaining)
+        for filename in remaining:
+            if cancel is not None and cancel.is_set():
+                raise DownloadCancelled()
+            ingest(filename)
+
+        for future in pending:
+            future.result()
+        scanner.commit()
+    finally:
+        # Let queued thumbnails finish and reach the writer even if the download failed midway
+        wait(pending)
+        if own_thumbnails:
+            thumbnails.close()
+            output_callback(thumbnails.summary())
+        else:
+            thumbnails.save()
+        if own_content_index:
+            output_callback(content_index.summary())
+            content_index.close()
+        elif content_index is not None:
+            content_index.flush()
+        if own_writer:
+            writer.close()
+            output_callback(writer.summary())
+            if writer.errors:
+                output_callback(f"❌ Database write failed: {writer.errors[0]}")
+        journal.checkpoint()
+
+    output_callback("\n✅ Download and insert complete.")
+    return inserted
+
+def resume_journal(output_callback, writer=None, thumbnails=None):
+    """Finishes the files an interrupted run left in the job journal and returns how many there were.
+
+    Files still waiting for a thumbnail get one (the thumbnail stage skips any that were already
+    written); the rest go straight to the writer, which ignores rows committed before the
+    interruption. Passed-in stages are shared with the jobs, like in download_media.
+    """
+    journal = get_journal()
+    entries = journal.unfinished()
+    if not entries:
+        return 0
+    output_callback(f"Resuming {len(entries)} unfinished files from the job journal...")
+
+    own_thumbnails = thumbnails is None
+    if own_thumbnails:
+        thumbnails = ThumbnailStage(FFMPEG_EXE)
+    own_writer = writer is None
+    if own_writer:
+        writer = DatabaseWriter(get_repository()).start()
+    writer.add_on_written(journal.mark_inserted)
+
+    def thumbnailed(record, ok):
+        if not ok:
+            record = record._replace(thumbnail_file=record.file)
+        journal.mark_thumbnailed(record.file, record.thumbnail_file)
+        writer.insert(record)
+
+    pending = []
+    resumed = 0
+    try:
+        for record, state in entries:
+            if not Path(record.file).is_file():
+                journal.forget(record.file)
+                continue
+            resumed += 1
+            if state == "downloaded" and record.thumbnail_file != record.file:
+                pending.append(thumbnails.submit(
+                    Path(record.file), Path(record.thumbnail_file), output_callback,
+                    then=lambda ok, record=record: thumbnailed(record, ok)
+                ))
+            else:
+                writer.insert(record)
+    finally:
+        wait(pending)
+        if own_thumbnails:
+            thumbnails.close()
+        else:
+            thumbnails.save()
+        if own_writer:
+            writer.close()
+            output_callback(writer.summary())
+            if writer.errors:
+                output_callback(f"❌ Database write failed: {writer.errors[0]}")
+        journal.checkpoint()
+    output_callback(f"✅ Resumed {resumed} files ({len(entries) - resumed} no longer on disk).")
+    return resumed
+
+def insert_manual_media(subscription_id_blob, username, file_paths, output_callback, duplicates=DEFAULT_DUPLICATES,
+                        strategy=DEFAULT_IMPORT_STRATEGY, progress_callback=None):
+    """Imports files into a user's folder and inserts rows for the ones the user did not have yet.
+
+    Files are transferred with `strategy` (see importer.transfer_files); with `duplicates` set to
+    "link" or "skip", a file whose content is already in the library is hardlinked or left out
+    instead. `progress_callback(done, total, unit)` gets the transferred megabytes ("MB") and
+    then the inserted files ("files"). Returns the number of rows queued for insertion.
+    """
+    repository = get_repository()
+    owner_id = repository.owner_id_for(username)
+    created_time = int(time.time())
+
+    user_media_path = MEDIA_BASE_PATH / username
+    user_thumb_path = user_media_path / THUMBNAIL_FOLDER_NAME
+    user_media_path.mkdir(parents=True, exist_ok=True)
+    user_thumb_path.mkdir(parents=True, exist_ok=True)
+
+    content_index = ContentIndex(CONTENT_INDEX_FILE) if duplicates != "keep" else None
+    copied = []
+    try:
+        to_transfer = []
+        for fpath, dest_path in plan_destinations(file_paths, user_media_path):
+            if dest_path.exists():
+                copied.append((fpath, dest_path))
+                continue
+            if content_index is None:
+                to_transfer.append((fpath, dest_path))
+                continue
+            file_relative_path = str(dest_path.relative_to(MEDIA_BASE_PATH.parent))
+            try:
+                # A file the library already has is linked (or skipped) instead of transferred
+                duplicate = content_index.find_duplicate(fpath, file_relative_path)
+            except OSError as e:
+                output_callback(f"❌ Failed to read {fpath}: {e}")
+                continue
+            if duplicate and duplicates == "skip":
+                content_index.discard(file_relative_path)
+                output_callback(f"Skipping duplicate of {duplicate}: {fpath.name}")
+            elif duplicate and link_duplicate(duplicate, dest_path):
+                output_callback(f"Linked duplicate of {duplicate}: {fpath.name}")
+                content_index.add(file_relative_path, dest_path)
+                copied.append((fpath, dest_path))
+            else:
+                to_transfer.append((fpath, dest_path))
+
+        if to_transfer:
+            output_callback(f"Importing {len(to_transfer)} files ({strategy})...")
+        transferred = transfer_files(
+            to_transfer, strategy, output_callback=output_callback,
+            progress_callback=progress_callback and (
+                lambda done, total: progress_callback(done / 2 ** 20, total / 2 ** 20, "MB")
+            )
+        )
+        for fpath, dest_path in transferred:
+            if content_index is not None:
+                content_index.add(str(dest_path.relative_to(MEDIA_BASE_PATH.parent)), dest_path)
+            copied.append((fpath, dest_path))
+    finally:
+        if content_index is not None:
+            content_index.close()
+
+    known_files = repository.known_files(subscription_id_blob)
+
+    new_files = []
+    for fpath, dest_path in copied:
+        file_relative_path = str(dest_path.relative_to(MEDIA_BASE_PATH.parent))
+        if file_relative_path in known_files:
+            output_callback(f"Skipping existing: {fpath.name}")
+            continue
+        new_files.append((fpath, dest_path))
+
+    thumbnails = ThumbnailStage(FFMPEG_EXE)
+    writer = DatabaseWriter(repository).start()
+    try:
+        thumb_paths = {
+            dest_path: user_thumb_path / thumbnail_name(dest_path)
+            for fpath, dest_path in new_files if needs_thumbnail(dest_path)
+        }
+        made = thumbnails.generate(thumb_paths.items(), output_callback)
+
+        for done, (fpath, dest_path) in enumerate(new_files, 1):
+            file_relative_path = str(dest_path.relative_to(MEDIA_BASE_PATH.parent))
+
+            if made.get(dest_path):
+                thumbnail_relative_path = str(thumb_paths[dest_path].relative_to(MEDIA_BASE_PATH.parent))
+            else:
+                thumbnail_relative_path = file_relative_path
+
+            writer.insert(MediaRecord(
+                subscription_id_blob,
+                created_time,
+                thumbnail_relative_path,
+                file_relative_path,
+                username,
+                owner_id
+            ))
+            known_files.add(file_relative_path)
+            output_callback(f"Inserted manually: {dest_path.name}")
+            if progress_callback:
+                progress_callback(done, len(new_files), "files")
+    finally:
+        thumbnails.close()
+        writer.close()
+
+    output_callback(thumbnails.summary())
+    output_callback(writer.summary())
+    if writer.errors:
+        output_callback(f"❌ Database write failed: {writer.errors[0]}")
+    output_callback("\n✅ Manual insert complete.")
+    return len(new_files)
+
+def load_settings():
+    """Returns a copy of the saved settings ({} if there are none or the file is unreadable)."""
+    return get_settings_store().snapshot()
+
+def save_settings(settings):
+    """Saves the values that changed, atomically; returns True if the file was written. Raises OSError."""
+    return get_settings_store().update(settings)
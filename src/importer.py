@@ -0,0 +1,162 @@
+import errno
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from scanner import MEDIA_EXTENSIONS
+
+# === IMPORT DEFAULTS ===
+IMPORT_STRATEGIES = ("auto", "hardlink", "reflink", "move", "copy")
+DEFAULT_IMPORT_STRATEGY = "auto"
+IMPORT_WORKERS = 4
+COPY_CHUNK = 8 * 1024 * 1024
+# Errors that mean "not possible here" (other volume, unsupported filesystem) rather than a real failure
+_UNSUPPORTED = {errno.EXDEV, errno.EPERM, errno.EACCES, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP,
+                errno.ENOTSUP, errno.EMLINK}
+
+
+def find_media(folder, extensions=MEDIA_EXTENSIONS):
+    """Walks `folder` recursively and returns every media file in it, sorted by path."""
+    found = []
+    stack = [folder]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.name.lower().endswith(tuple(extensions)) and entry.is_file():
+                    found.append(Path(entry.path))
+    return sorted(found)
+
+
+def plan_destinations(sources, folder):
+    """Maps each source to a file in `folder`, renaming sources that share a name within one import."""
+    used = set()
+    plan = []
+    for source in sources:
+        source = Path(source)
+        dest = Path(folder) / source.name
+        n = 1
+        while dest.name.lower() in used:
+            dest = Path(folder) / f"{source.stem}_{n}{source.suffix}"
+            n += 1
+        used.add(dest.name.lower())
+        plan.append((source, dest))
+    return plan
+
+
+def _copy_chunks(source, dest, progress):
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        while True:
+            chunk = src.read(COPY_CHUNK)
+            if not chunk:
+                break
+            dst.write(chunk)
+            progress(len(chunk))
+    shutil.copystat(source, dest)
+
+
+def _reflink(source, dest, progress):
+    """Copies through copy_file_range, which shares extents on btrfs/XFS and stays in the kernel elsewhere."""
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    size = os.stat(source).st_size
+    with open(source, "rb") as src, open(dest, "wb") as dst:
+        copied = 0
+        while copied < size:
+            n = os.copy_file_range(src.fileno(), dst.fileno(), min(COPY_CHUNK, size - copied))
+            if n == 0:
+                break
+            copied += n
+            progress(n)
+    shutil.copystat(source, dest)
+
+
+def transfer_file(source, dest, strategy=DEFAULT_IMPORT_STRATEGY, progress=lambda n: None):
+    """Puts `source` at `dest` with the given strategy and returns the method that was used.
+
+    "auto" tries a hardlink, then a reflink, then a chunked copy. "hardlink" and "reflink" fall
+    back to a copy when the filesystem cannot do them; "move" copies and deletes across volumes.
+    Copies go through a temporary file, so `dest` never holds a partial file.
+    """
+    size = os.stat(source).st_size
+    tmp_path = Path(f"{dest}.part")
+    if strategy == "move":
+        try:
+            os.replace(source, dest)
+            progress(size)
+            return "move"
+        except OSError as e:
+            if e.errno != errno.EXDEV:
+                raise
+    if strategy in ("auto", "hardlink"):
+        try:
+            os.link(source, dest)
+            progress(size)
+            return "hardlink"
+        except OSError as e:
+            if e.errno not in _UNSUPPORTED:
+                raise
+    methods = [("reflink", _reflink)] if strategy in ("auto", "reflink") else []
+    methods.append(("copy", _copy_chunks))
+    for method, copy in methods:
+        done = [0]
+
+        def counted(n):
+            done[0] += n
+            progress(n)
+
+        try:
+            copy(source, tmp_path, counted)
+            os.replace(tmp_path, dest)
+        except OSError as e:
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+            # Give back the bytes reported so far before trying the next method
+            progress(-done[0])
+            if method == "copy" or e.errno not in _UNSUPPORTED:
+                raise
+            continue
+        if strategy == "move":
+            os.unlink(source)
+            return "move"
+        return method
+
+
+def transfer_files(plan, strategy=DEFAULT_IMPORT_STRATEGY, workers=IMPORT_WORKERS, output_callback=None,
+                   progress_callback=None):
+    """Transfers (source, dest) pairs on a thread pool and returns the pairs that made it.
+
+    `progress_callback(done_bytes, total_bytes)` is called as chunks are written.
+    """
+    total = 0
+    for source, _ in plan:
+        try:
+            total += os.stat(source).st_size
+        except OSError:
+            pass
+    lock = threading.Lock()
+    done = 0
+
+    def progress(n):
+        nonlocal done
+        with lock:
+            done += n
+            if progress_callback:
+                progress_callback(done, total)
+
+    def job(source, dest):
+        try:
+            return transfer_file(source, dest, strategy, progress)
+        except OSError as e:
+            if output_callback:
+                output_callback(f"❌ Failed to import {source}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        futures = [(source, dest, pool.submit(job, source, dest)) for source, dest in plan]
+        return [(source, dest) for source, dest, future in futures if future.result() is not None]
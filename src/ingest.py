@@ -0,0 +1,228 @@
+import queue
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+
+# === INGESTION DEFAULTS ===
+BATCH_SIZE = 500
+BATCH_WAIT = 0.25
+BUSY_TIMEOUT_MS = 10000
+# Stay well below SQLITE_MAX_VARIABLE_NUMBER on old builds (999)
+SQL_CHUNK = 500
+# Above this many rows a subscription's index keeps 64-bit hashes instead of path strings
+COMPACT_INDEX_THRESHOLD = 250000
+
+MediaRecord = namedtuple(
+    "MediaRecord",
+    ["subscription_id", "created_time", "thumbnail_file", "file", "owner_name", "owner_id"]
+)
+
+_STOP = object()
+
+
+def configure_connection(conn, wal=True):
+    """Applies the write-friendly pragmas the database allows and returns the journal mode in use."""
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    mode = conn.execute("PRAGMA journal_mode").fetchone()[0]
+    if wal and mode.lower() != "wal":
+        try:
+            # Refused (and left unchanged) on e.g. network shares or read-only media
+            mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+        except sqlite3.Error:
+            pass
+    if mode.lower() == "wal":
+        conn.execute("PRAGMA synchronous = NORMAL")
+    return mode.lower()
+
+
+def existing_files(conn, files, media_table="photos"):
+    """Returns the subset of `files` that already has a row, using one query per chunk."""
+    files = list(files)
+    found = set()
+    for i in range(0, len(files), SQL_CHUNK):
+        chunk = files[i:i + SQL_CHUNK]
+        placeholders = ",".join("?" * len(chunk))
+        rows = conn.execute(f"SELECT file FROM {media_table} WHERE file IN ({placeholders})", chunk)
+        found.update(row[0] for row in rows)
+    return found
+
+
+def has_file_index(conn, media_table="photos"):
+    """Returns True if some index on `media_table` starts with the `file` column."""
+    for row in conn.execute(f"PRAGMA index_list({media_table})").fetchall():
+        name = row[1].replace('"', '""')
+        columns = conn.execute(f'PRAGMA index_info("{name}")').fetchall()
+        if columns and columns[0][2] == "file":
+            return True
+    return False
+
+
+def ensure_file_index(conn, media_table="photos", create=False):
+    """Checks for an index on `file`, creating it when `create` is set. Returns True if one exists afterwards."""
+    if has_file_index(conn, media_table):
+        return True
+    if not create:
+        return False
+    with conn:
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{media_table}_file ON {media_table}(file)")
+    return True
+
+
+class KnownFilesIndex:
+    """In-memory set of the files a subscription already has rows for.
+
+    Loaded once per job so every dedupe check is an O(1) lookup instead of a query. Very large
+    accounts switch to storing hashes of the paths, which roughly halves the memory footprint.
+    """
+
+    def __init__(self, files=(), compact=False):
+        self.compact = compact
+        self._keys = set()
+        for file in files:
+            self.add(file)
+
+    @classmethod
+    def load(cls, conn, subscription_id, media_table="photos", compact_threshold=COMPACT_INDEX_THRESHOLD):
+        index = cls()
+        rows = conn.execute(f"SELECT file FROM {media_table} WHERE subscriptionId = ?", (subscription_id,))
+        for (file,) in rows:
+            if file is None:
+                continue
+            index.add(file)
+            if not index.compact and len(index) > compact_threshold:
+                index.make_compact()
+        return index
+
+    def make_compact(self):
+        if not self.compact:
+            self._keys = {hash(key) for key in self._keys}
+            self.compact = True
+
+    def _key(self, file):
+        return hash(file) if self.compact else file
+
+    def add(self, file):
+        self._keys.add(self._key(file))
+
+    def __contains__(self, file):
+        return self._key(file) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+
+class DatabaseWriter:
+    """Applies queued inserts through a repository's write connection on a background thread.
+
+    Records are drained from the queue in batches of up to `batch_size` and handed to
+    `repository.insert_media_batch`, which deduplicates them with one query and writes them with
+    executemany in a single short transaction. Each transaction is recorded as the "insert_commit"
+    stage of `report` when given, and `on_written(records)`, plus every callback registered with
+    `add_on_written`, is called with every batch once its rows are committed (rows that already
+    existed included).
+    """
+
+    def __init__(self, repository, batch_size=BATCH_SIZE, batch_wait=BATCH_WAIT, report=None, on_written=None):
+        self.repository = repository
+        self.report = report
+        self._on_written = [on_written] if on_written is not None else []
+        self._callbacks_lock = threading.Lock()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue()
+        self.rows_written = 0
+        self.rows_skipped = 0
+        self.batches = 0
+        self.write_seconds = 0.0
+        self.errors = []
+        self._started = None
+        self._finished = None
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @property
+    def journal_mode(self):
+        return self.repository.journal_mode
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread.start()
+        return self
+
+    def add_on_written(self, callback):
+        """Registers another `on_written` callback; one that is already registered is not added twice."""
+        with self._callbacks_lock:
+            if callback not in self._on_written:
+                self._on_written = self._on_written + [callback]
+
+    def insert(self, record):
+        self.queue.put(MediaRecord(*record))
+
+    def close(self):
+        self.queue.put(_STOP)
+        self._thread.join()
+
+    @property
+    def rows_per_second(self):
+        end = self._finished or time.monotonic()
+        elapsed = end - (self._started or end)
+        return self.rows_written / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        avg_ms = (self.write_seconds / self.batches * 1000) if self.batches else 0.0
+        return (
+            f"Wrote {self.rows_written} rows ({self.rows_skipped} duplicates skipped) in {self.batches} batches, "
+            f"{self.rows_per_second:.1f} rows/s, {avg_ms:.1f} ms per transaction ({self.journal_mode} journal)"
+        )
+
+    def _next_batch(self):
+        """Blocks for the first record, then gathers more until the batch is full or the queue goes quiet."""
+        batch = []
+        stop = False
+        item = self.queue.get()
+        deadline = time.monotonic() + self.batch_wait
+        while True:
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+            if len(batch) >= self.batch_size:
+                break
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+        return batch, stop
+
+    def _write_batch(self, batch):
+        try:
+            written, skipped, seconds = self.repository.insert_media_batch(batch)
+        except sqlite3.Error as e:
+            self.errors.append(e)
+            return
+        self.rows_written += written
+        self.rows_skipped += skipped
+        self.write_seconds += seconds
+        self.batches += 1
+        if self.report is not None:
+            self.report.record("insert_commit", seconds)
+            self.report.count("rows_written", written)
+            self.report.count("rows_skipped", skipped)
+        for callback in self._on_written:
+            try:
+                callback(batch)
+            except sqlite3.Error as e:
+                self.errors.append(e)
+
+    def _run(self):
+        try:
+            stop = False
+            while not stop:
+                batch, stop = self._next_batch()
+                if batch:
+                    self._write_batch(batch)
+        finally:
+            self._finished = time.monotonic()
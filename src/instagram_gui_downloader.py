@@ -2,167 +2,30 @@ import os
 import sys
 import subprocess
 import time
-import sqlite3
 import threading
-import json
-from pathlib import Path
+import queue
 import tkinter as tk
 from tkinter import ttk, messagebox, filedialog
-
-# === DEFAULT CONFIG VALUES ===
-MEDIA_TABLE = "photos"
-SUBSCRIPTIONS_TABLE = "subscriptions"
-MEDIA_BASE_PATH = Path("instagram")
-THUMBNAIL_FOLDER_NAME = "thumbnails"
-FFMPEG_EXE = "assets/ffmpeg.exe"
-GDL_EXE = "assets/gallery-dl.exe"
-SETTINGS_FILE = "settings.json"
-
-# Automatically detect database file with .stogram.sqlite extension
-DB_FILE = None
-for file in os.listdir():
-    if file.endswith(".stogram.sqlite"):
-        candidate = Path(file)
-        if candidate.is_file():
-            DB_FILE = candidate
-            break
-
-GDL_INCLUDE_OPTIONS = {
-    "All": "all",
-    "All (except Tagged)": "posts,stories,highlights,reels,avatar",
-    "Posts": "posts",
-    "Stories": "stories",
-    "Highlights": "highlights",
-    "Reels": "reels",
-    "Avatar": "avatar",
-    "Tagged": "tagged"
-}
-
-def fetch_users():
-    try:
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT id, query FROM {SUBSCRIPTIONS_TABLE} WHERE id IS NOT NULL AND query IS NOT NULL")
-        users = cursor.fetchall()
-        conn.close()
-        return users
-    except sqlite3.Error:
-        return []
-
-def validate_database(file_path):
-    try:
-        conn = sqlite3.connect(file_path)
-        cursor = conn.cursor()
-        cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{MEDIA_TABLE}'")
-        if cursor.fetchone() is None:
-            return False
-        cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{SUBSCRIPTIONS_TABLE}'")
-        if cursor.fetchone() is None:
-            return False
-        return True
-    except Exception:
-        return False
-    finally:
-        conn.close()
-
-def download_media(subscription_id_blob, username, output_callback, media_type="Posts", post_limit=10, browser="firefox"):
-    user_media_path = MEDIA_BASE_PATH / username
-    user_thumb_path = user_media_path / THUMBNAIL_FOLDER_NAME
-    user_media_path.mkdir(parents=True, exist_ok=True)
-    user_thumb_path.mkdir(parents=True, exist_ok=True)
-
-    output_callback(f"Downloading {media_type.lower()} from Instagram for @{username} using {browser} cookies...")
-
-    if media_type == "Stories":
-        url = f"https://www.instagram.com/stories/{username}/"
-    else:
-        url = f"https://www.instagram.com/{username}/"
-
-    try:
-        subprocess.run([
-            GDL_EXE,
-            url,
-            "--cookies-from-browser", browser,
-            "-o", f"include={GDL_INCLUDE_OPTIONS[media_type]}",
-            "-o", f"extractor.instagram.max-posts={post_limit}",
-            "-D", str(user_media_path)
-        ], check=True)
-    except subprocess.CalledProcessError as e:
-        output_callback(f"❌ gallery-dl failed: {e}")
-        return
-
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    created_time = int(time.time())
-
-    cursor.execute(f"SELECT instagram_id FROM {SUBSCRIPTIONS_TABLE} WHERE query = ?", (username,))
-    result = cursor.fetchone()
-    owner_id = result[0] if result else None
-
-    cutoff_time = time.time() - (30 * 60)
-    output_callback(f"Scanning for new media in {user_media_path} (created within last 30 minutes)...")
-
-    media_files = [
-        f for f in os.listdir(user_media_path)
-        if f.lower().endswith((".jpg", ".jpeg", ".png", ".mp4")) and
-           os.path.getctime(user_media_path / f) >= cutoff_time
-    ]
-
-    for filename in media_files:
-        full_path = user_media_path / filename
-        file_relative_path = str(full_path.relative_to(MEDIA_BASE_PATH.parent))
-
-        cursor.execute(f"SELECT COUNT(*) FROM {MEDIA_TABLE} WHERE file = ?", (file_relative_path,))
-        if cursor.fetchone()[0] > 0:
-            output_callback(f"Skipping existing: {filename}")
-            continue
-
-        if filename.lower().endswith('.mp4'):
-            thumb_name = f"{Path(filename).stem}.jpg"
-            thumb_path = user_thumb_path / thumb_name
-            subprocess.run([
-                FFMPEG_EXE,
-                "-ss", "3",
-                "-i", str(full_path),
-                "-vframes", "1",
-                str(thumb_path)
-            ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            thumbnail_relative_path = str(thumb_path.relative_to(MEDIA_BASE_PATH.parent))
-        else:
-            thumbnail_relative_path = file_relative_path
-
-        cursor.execute(f"""
-            INSERT INTO {MEDIA_TABLE} (subscriptionId, created_time, thumbnail_file, file, ownerName, ownerId)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            subscription_id_blob,
-            created_time,
-            thumbnail_relative_path,
-            file_relative_path,
-            username,
-            owner_id
-        ))
-        output_callback(f"Inserted: {filename}")
-
-    conn.commit()
-    conn.close()
-    output_callback("\n✅ Download and insert complete.")
-
-def load_settings():
-    if Path(SETTINGS_FILE).exists():
-        try:
-            with open(SETTINGS_FILE, "r") as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
-
-def save_settings(settings):
-    try:
-        with open(SETTINGS_FILE, "w") as f:
-            json.dump(settings, f)
-    except Exception:
-        pass
+from ingest import DatabaseWriter
+from telemetry import StageReport, new_run_id, write_json
+from thumbnails import ThumbnailStage
+from content_index import ContentIndex
+from ratelimit import DownloadScheduler, DEFAULT_LAUNCHES_PER_MINUTE
+from importer import IMPORT_STRATEGIES, DEFAULT_IMPORT_STRATEGY, find_media
+from downloader import (
+    FFMPEG_EXE, CONTENT_INDEX_FILE, REPORT_DIR, DEFAULT_DUPLICATES, GDL_INCLUDE_OPTIONS, DownloadCancelled,
+    find_database, get_repository, close_repository, close_journal, get_profiles, cached_users, fetch_users,
+    validate_database, download_media, resume_journal, insert_manual_media, load_settings, save_settings
+)
+
+# === UI TUNING ===
+LOG_MAX_LINES = 2000
+EVENT_POLL_MS = 100
+EVENT_BATCH_SIZE = 1000
+DEFAULT_PARALLEL_JOBS = 2
+
+def format_eta(seconds):
+    return f"{int(seconds // 60)}:{int(seconds % 60):02d}"
 
 class IntegerEntry(ttk.Entry):
     def __init__(self, master=None, **kwargs):
@@ -197,79 +60,188 @@ class InstagramDownloaderApp:
     def __init__(self, root):
         self.root = root
         self.root.title("Instagram Media Downloader Pro")
-        self.root.geometry("720x720")
+        self.root.geometry("820x940")
         self.root.configure(bg="#f0f0f0")
         self.users = []
-        self.media_type = tk.StringVar()
+        self.visible_users = []
+        self.search_index = []
+        self.visible_index = []
+        self.filter_text = None
+        self.jobs = {}
+        self.next_job_id = 1
+        self.writer = None
+        self.thumbnails = None
+        self.content_index = None
+        self.scheduler = None
+        self.run_report = None
+        # Startup, resume and manual import threads; closing waits for them like for the jobs
+        self.workers = []
+        self.closing = False
+        self.events = queue.Queue()
+        self.job_started = None
+        self.manual_started = None
+        self.progress_unit = None
         self.browser_choice = tk.StringVar()
+        self.write_metadata = tk.BooleanVar()
+        self.parallel_jobs = tk.IntVar()
+        self.duplicates = tk.StringVar()
+        self.import_strategy = tk.StringVar()
 
         self.settings = load_settings()
         self.browser_choice.set(self.settings.get("browser", "firefox"))
-        self.media_type.set(self.settings.get("media_type", "Posts"))
+        self.write_metadata.set(self.settings.get("write_metadata", False))
+        self.parallel_jobs.set(self.settings.get("parallel_jobs", DEFAULT_PARALLEL_JOBS))
+        self.duplicates.set(self.settings.get("duplicates", DEFAULT_DUPLICATES))
+        self.import_strategy.set(self.settings.get("import_strategy", DEFAULT_IMPORT_STRATEGY))
+        saved_types = self.settings.get("media_types") or [self.settings.get("media_type", "Posts")]
+        self.media_type_vars = {mtype: tk.BooleanVar(value=mtype in saved_types) for mtype in GDL_INCLUDE_OPTIONS}
 
         self.create_widgets()
         self.root.after(100, self.center_window)
+        self.root.after(EVENT_POLL_MS, self.drain_events)
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
         self.post_limit_entry.set_value(self.settings.get("post_limit", 10))
-        if not DB_FILE or not validate_database(DB_FILE):
+        # The window paints first; the database is found, validated and read in the background
+        self.db_label.config(text="Looking for a database...")
+        self.start_worker(self.startup_worker)
+
+    def startup_worker(self):
+        """Finds and validates the database once, loads the users, then resumes unfinished work."""
+        try:
+            db_file = find_database()
+            valid = bool(db_file) and validate_database(db_file)
+        except OSError:
+            db_file, valid = None, False
+        self.events.put(("database", (db_file, valid)))
+        if not valid:
+            return
+        users = cached_users()
+        self.events.put(("users", users if users is not None else fetch_users()))
+        self.resume_worker()
+
+    def database_ready(self, db_file, valid):
+        """Returns False if there is no usable database, after closing the window."""
+        if not valid:
             messagebox.showwarning(
                 "No Database Found",
                 "No valid '.stogram.sqlite' database file was found in the current directory.\n"
                 "Please put me and /assets folder the same directory as the 4K stogram database"
             )
             self.root.destroy()  # Gracefully close the GUI if no database is found
-        if DB_FILE and validate_database(DB_FILE):
-            self.db_label.config(text=str(DB_FILE))
-            self.reload_users()
-            self.start_button.config(state="normal")
-            self.refresh_button.config(state="normal")
+            return False
+        self.db_label.config(text=f"{db_file} (loading users...)")
+        self.start_button.config(state="normal")
+        return True
+
+    def start_worker(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        self.workers = [worker for worker in self.workers if worker.is_alive()] + [thread]
+        thread.start()
+
+    def resume_worker(self):
+        """Finishes work an interrupted session left in the job journal."""
+        try:
+            resume_journal(self.log_output)
+        except Exception as e:
+            self.log_output(f"❌ Could not resume unfinished work: {e}")
 
     def create_widgets(self):
         self.db_label = ttk.Label(self.root, text="No database selected", font=("Segoe UI", 10, "italic"))
         self.db_label.pack(pady=5)
 
         user_frame = ttk.LabelFrame(self.root, text="User Selection")
-        user_frame.pack(pady=10, fill='x', padx=20)
-        ttk.Label(user_frame, text="Instagram User:", font=("Segoe UI", 11)).pack(anchor='w', padx=10, pady=5)
-
-        self.user_var = tk.StringVar()
-        self.user_dropdown = ttk.Combobox(user_frame, textvariable=self.user_var, state="readonly", font=("Segoe UI", 10))
-        self.user_dropdown.pack(pady=5, padx=10, fill='x')
+        user_frame.pack(pady=5, fill='x', padx=20)
+        filter_row = ttk.Frame(user_frame)
+        filter_row.pack(fill='x', padx=10, pady=5)
+        ttk.Label(filter_row, text="Filter:", font=("Segoe UI", 11)).pack(side='left')
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add("write", lambda *args: self.apply_user_filter())
+        ttk.Entry(filter_row, textvariable=self.filter_var).pack(side='left', fill='x', expand=True, padx=5)
+        ttk.Button(filter_row, text="Select All", command=self.select_all_users).pack(side='left', padx=5)
+        self.selection_label = ttk.Label(filter_row, text="")
+        self.selection_label.pack(side='left', padx=5)
+
+        list_row = ttk.Frame(user_frame)
+        list_row.pack(fill='x', padx=10, pady=5)
+        self.user_list = tk.Listbox(list_row, selectmode=tk.EXTENDED, height=7, font=("Segoe UI", 10),
+                                    exportselection=False)
+        user_scroll = ttk.Scrollbar(list_row, command=self.user_list.yview)
+        self.user_list.config(yscrollcommand=user_scroll.set)
+        self.user_list.bind("<<ListboxSelect>>", lambda e: self.update_selection_label())
+        user_scroll.pack(side='right', fill='y')
+        self.user_list.pack(side='left', fill='x', expand=True)
 
         media_type_frame = ttk.LabelFrame(self.root, text="Download Type")
-        media_type_frame.pack(pady=10, fill='x', padx=20)
-        for mtype in GDL_INCLUDE_OPTIONS.keys():
-            #ttk.Radiobutton(media_type_frame, text=mtype, variable=self.media_type, value=mtype).pack(anchor='w', padx=10, pady=2)
-            ttk.Radiobutton(media_type_frame, text=mtype, variable=self.media_type, value=mtype).pack(side='left', padx=5, pady=2)
+        media_type_frame.pack(pady=5, fill='x', padx=20)
+        for mtype, var in self.media_type_vars.items():
+            ttk.Checkbutton(media_type_frame, text=mtype, variable=var).pack(side='left', padx=5, pady=2)
 
         browser_frame = ttk.LabelFrame(self.root, text="Browser for Cookies")
-        browser_frame.pack(pady=10, fill='x', padx=20)
+        browser_frame.pack(pady=5, fill='x', padx=20)
         browser_dropdown = ttk.Combobox(browser_frame, textvariable=self.browser_choice, state="readonly", width=15)
         browser_dropdown['values'] = ("firefox", "chrome")
         browser_dropdown.pack(padx=10, pady=5)
 
         range_frame = ttk.LabelFrame(self.root, text="Post Limit")
-        range_frame.pack(pady=10, fill='x', padx=20)
+        range_frame.pack(pady=5, fill='x', padx=20)
         ttk.Label(range_frame, text="Number of latest posts:").pack(side='left', padx=10, pady=5)
         self.post_limit_entry = IntegerEntry(range_frame, width=6)
         self.post_limit_entry.pack(side='left', pady=5)
 
-        self.start_button = ttk.Button(self.root, text="Start Download", command=self.start_download, state="disabled")
-        self.start_button.pack(pady=10)
+        options_frame = ttk.LabelFrame(self.root, text="Options")
+        options_frame.pack(pady=5, fill='x', padx=20)
+        ttk.Checkbutton(options_frame, text="Save metadata (real post dates and owners)",
+                        variable=self.write_metadata).pack(side='left', padx=10, pady=5)
+        ttk.Label(options_frame, text="Parallel jobs:").pack(side='left', padx=(20, 5))
+        ttk.Spinbox(options_frame, from_=1, to=16, width=4, textvariable=self.parallel_jobs).pack(side='left')
+        ttk.Label(options_frame, text="Duplicates:").pack(side='left', padx=(20, 5))
+        duplicates_dropdown = ttk.Combobox(options_frame, textvariable=self.duplicates, state="readonly", width=6)
+        duplicates_dropdown['values'] = ("link", "skip", "keep")
+        duplicates_dropdown.pack(side='left')
+
+        self.start_button = ttk.Button(self.root, text="Add to Queue", command=self.start_download, state="disabled")
+        self.start_button.pack(pady=5)
 
         self.refresh_button = ttk.Button(self.root, text="Reload Users", command=self.reload_users, state="disabled")
         self.refresh_button.pack(pady=5)
         
         ttk.Button(range_frame, text="Set to 0 (All)", command=lambda: self.post_limit_entry.set_value(0)).pack(side='left', padx=10)
-        ttk.Button(self.root, text="Add Media Manually to Database", command=self.add_manual_media).pack(pady=5)
+        manual_frame = ttk.Frame(self.root)
+        manual_frame.pack(pady=5)
+        ttk.Button(manual_frame, text="Add Media Manually to Database", command=self.add_manual_media).pack(side='left')
+        ttk.Button(manual_frame, text="Add Folder...", command=self.add_manual_folder).pack(side='left', padx=5)
+        ttk.Label(manual_frame, text="Import by:").pack(side='left', padx=(10, 5))
+        strategy_dropdown = ttk.Combobox(manual_frame, textvariable=self.import_strategy, state="readonly", width=9)
+        strategy_dropdown['values'] = IMPORT_STRATEGIES
+        strategy_dropdown.pack(side='left')
 
         # New button to run addusertodb.exe
         ttk.Button(self.root, text="Add Subscription to Database", command=self.run_addusertodb).pack(pady=5)
 
-        self.progress = ttk.Progressbar(self.root, mode='indeterminate')
+        queue_frame = ttk.LabelFrame(self.root, text="Job Queue")
+        queue_frame.pack(pady=5, fill='x', padx=20)
+        self.job_tree = ttk.Treeview(queue_frame, columns=("user", "type", "status", "files"), show="headings", height=6)
+        for column, title, width in (("user", "User", 220), ("type", "Type", 150), ("status", "Status", 150),
+                                     ("files", "Files", 100)):
+            self.job_tree.heading(column, text=title)
+            self.job_tree.column(column, width=width)
+        job_scroll = ttk.Scrollbar(queue_frame, command=self.job_tree.yview)
+        self.job_tree.config(yscrollcommand=job_scroll.set)
+        job_buttons = ttk.Frame(queue_frame)
+        job_buttons.pack(side='bottom', fill='x', pady=5)
+        ttk.Button(job_buttons, text="Cancel Selected", command=self.cancel_jobs).pack(side='left', padx=10)
+        ttk.Button(job_buttons, text="Retry Selected", command=self.retry_jobs).pack(side='left', padx=5)
+        ttk.Button(job_buttons, text="Clear Finished", command=self.clear_finished_jobs).pack(side='left', padx=5)
+        job_scroll.pack(side='right', fill='y')
+        self.job_tree.pack(fill='x', padx=(10, 0))
+
+        self.progress = ttk.Progressbar(self.root, mode='determinate')
         self.progress.pack(fill='x', padx=20, pady=5)
+        self.progress_label = ttk.Label(self.root, text="", font=("Segoe UI", 9))
+        self.progress_label.pack()
 
-        self.output_box = tk.Text(self.root, height=12, wrap='word', font=("Consolas", 10))
+        self.output_box = tk.Text(self.root, height=8, wrap='word', font=("Consolas", 10))
         self.output_box.pack(fill='both', expand=True, padx=10, pady=10)
 
     def run_addusertodb(self):
@@ -289,75 +261,370 @@ class InstagramDownloaderApp:
             messagebox.showerror("Execution Failed", str(e))
 
     def log_output(self, text):
-        self.output_box.insert(tk.END, f"{text}\n")
+        """Queues a log line; safe to call from any thread."""
+        self.events.put(("log", text))
+
+    def report_progress(self, done, total, unit="files"):
+        """Queues a progress update; safe to call from any thread."""
+        self.events.put(("progress", (done, total, unit)))
+
+    def drain_events(self):
+        """Applies queued worker events on the Tk main loop, a batch at a time."""
+        lines = []
+        try:
+            for _ in range(EVENT_BATCH_SIZE):
+                kind, payload = self.events.get_nowait()
+                if kind == "log":
+                    lines.append(payload)
+                    continue
+                if lines:
+                    self.append_log(lines)
+                    lines = []
+                if kind == "progress":
+                    self.update_progress(*payload)
+                elif kind == "done":
+                    self.manual_finished()
+                elif kind == "job_progress":
+                    self.update_job_progress(*payload)
+                elif kind == "job_done":
+                    self.finish_job(*payload)
+                elif kind == "users":
+                    self.show_users(payload)
+                elif kind == "database" and not self.database_ready(*payload):
+                    return
+        except queue.Empty:
+            pass
+        if lines:
+            self.append_log(lines)
+        self.dispatch_jobs()
+        self.root.after(EVENT_POLL_MS, self.drain_events)
+
+    def append_log(self, lines):
+        self.output_box.insert(tk.END, "\n".join(lines) + "\n")
+        # Keep only the newest lines so a huge run never slows the widget down
+        line_count = int(self.output_box.index("end-1c").split(".")[0])
+        if line_count > LOG_MAX_LINES:
+            self.output_box.delete("1.0", f"{line_count - LOG_MAX_LINES + 1}.0")
         self.output_box.see(tk.END)
-        self.root.update_idletasks()
+
+    def update_progress(self, done, total, unit="files"):
+        if unit != self.progress_unit:
+            # A new phase (e.g. from copying megabytes to inserting files) gets its own rate
+            self.progress_unit = unit
+            self.manual_started = time.monotonic()
+        elapsed = time.monotonic() - self.manual_started if self.manual_started else 0
+        rate = done / elapsed if elapsed > 0 else 0.0
+        amount = f"{done:.0f}/{total:.0f}" if total else f"{done:.0f}"
+        if total:
+            if str(self.progress.cget("mode")) != "determinate":
+                self.progress.stop()
+                self.progress.config(mode="determinate")
+            self.progress.config(maximum=total, value=done)
+            eta = (total - done) / rate if rate > 0 else 0
+            self.progress_label.config(text=f"{amount} {unit} · {rate:.1f} {unit}/s · ETA {format_eta(eta)}")
+        else:
+            self.progress_label.config(text=f"{amount} {unit} · {rate:.1f} {unit}/s")
+
+    def manual_started_ui(self):
+        self.manual_started = time.monotonic()
+        self.progress_unit = None
+        self.progress.config(mode="indeterminate", value=0)
+        self.progress.start()
+        self.progress_label.config(text="")
+
+    def manual_finished(self):
+        self.progress.stop()
+        self.progress.config(mode="determinate", value=0)
 
     def reload_users(self):
-        self.users = fetch_users()
+        """Reads the users from the database again, in the background."""
+        self.refresh_button.config(state="disabled")
+        self.db_label.config(text=f"{find_database()} (loading users...)")
+        self.start_worker(lambda: self.events.put(("users", fetch_users())))
+
+    def show_users(self, users):
+        self.users = users
+        self.search_index = [(username.lower(), (subscription_id, username)) for subscription_id, username in users]
+        self.filter_text = None
+        self.db_label.config(text=str(find_database()))
+        self.refresh_button.config(state="normal")
         if not self.users:
-            self.user_dropdown['values'] = []
-            self.user_dropdown.set("")
             messagebox.showerror("Error", "No valid users found in the selected database.")
+        self.apply_user_filter()
+        last_users = set(self.settings.get("usernames") or [self.settings.get("username")])
+        for i, (_, username) in enumerate(self.visible_users):
+            if username in last_users:
+                self.user_list.selection_set(i)
+                self.user_list.see(i)
+        self.update_selection_label()
+
+    def apply_user_filter(self):
+        text = self.filter_var.get().strip().lower()
+        if text == self.filter_text:
+            return
+        # Typing more only narrows the previous matches, so search those instead of every user
+        if self.filter_text is not None and self.filter_text in text:
+            candidates = self.visible_index
         else:
-            self.user_dropdown['values'] = [f"{u[1]}" for u in self.users]
-            last_user = self.settings.get("username")
-            if last_user and last_user in self.user_dropdown['values']:
-                self.user_dropdown.set(last_user)
-            else:
-                self.user_dropdown.set(self.user_dropdown['values'][0])
+            candidates = self.search_index
+        self.filter_text = text
+        self.visible_index = [entry for entry in candidates if text in entry[0]]
+        self.visible_users = [user for _, user in self.visible_index]
+        self.user_list.delete(0, tk.END)
+        if self.visible_users:
+            self.user_list.insert(tk.END, *(u[1] for u in self.visible_users))
+        self.update_selection_label()
+
+    def select_all_users(self):
+        self.user_list.selection_set(0, tk.END)
+        self.update_selection_label()
+
+    def update_selection_label(self):
+        self.selection_label.config(text=f"{len(self.user_list.curselection())} of {len(self.users)} selected")
+
+    def selected_users(self):
+        return [self.visible_users[i] for i in self.user_list.curselection() if i < len(self.visible_users)]
 
     def start_download(self):
-        if not self.user_var.get():
-            messagebox.showwarning("Warning", "Please select a user.")
+        users = self.selected_users()
+        if not users:
+            messagebox.showwarning("Warning", "Please select at least one user.")
             return
 
-        index = self.user_dropdown.current()
-        if index < 0 or index >= len(self.users):
-            messagebox.showerror("Error", "Invalid user selection.")
+        media_types = [mtype for mtype, var in self.media_type_vars.items() if var.get()]
+        if not media_types:
+            messagebox.showwarning("Warning", "Please select at least one download type.")
             return
 
-        subscription_id_blob, username = self.users[index]
-        media_type = self.media_type.get()
         post_limit = self.post_limit_entry.get_value()
         browser = self.browser_choice.get()
+        metadata = self.write_metadata.get()
+        duplicates = self.duplicates.get()
 
         self.settings["browser"] = browser
-        self.settings["media_type"] = media_type
+        self.settings["write_metadata"] = metadata
+        self.settings["media_type"] = media_types[0]
+        self.settings["media_types"] = media_types
         self.settings["post_limit"] = post_limit
-        self.settings["username"] = username
-        save_settings(self.settings)
-
-        self.start_button.config(state="disabled")
-        self.progress.start()
-        self.log_output(f"⏳ Starting for {username} ({media_type}) with {browser} browser...\n")
-
-        threading.Thread(
-            target=self.download_worker,
-            args=(subscription_id_blob, username, media_type, post_limit, browser),
-            daemon=True
-        ).start()
+        self.settings["usernames"] = [u[1] for u in users]
+        self.settings["username"] = users[0][1]
+        self.settings["parallel_jobs"] = self.max_parallel_jobs()
+        self.settings["duplicates"] = duplicates
+        self.save_settings()
+        try:
+            get_profiles().set_preferences([u[1] for u in users], media_types, post_limit)
+        except OSError as e:
+            self.log_output(f"⚠️ Could not save the user profiles: {e}")
+
+        if not any(job["status"] in ("Queued", "Running") for job in self.jobs.values()):
+            self.job_started = time.monotonic()
+        for subscription_id_blob, username in users:
+            for media_type in media_types:
+                self.enqueue_job(subscription_id_blob, username, media_type, post_limit, browser, metadata,
+                                 duplicates)
+        self.log_output(f"⏳ Queued {len(users) * len(media_types)} jobs with {browser} browser...\n")
+        self.dispatch_jobs()
+
+    def save_settings(self):
+        try:
+            save_settings(self.settings)
+        except OSError as e:
+            self.log_output(f"⚠️ Could not save the settings: {e}")
 
-    def download_worker(self, subscription_id_blob, username, media_type, post_limit, browser):
+    def max_parallel_jobs(self):
         try:
-            download_media(subscription_id_blob, username, self.log_output, media_type, post_limit, browser)
+            return max(1, int(self.parallel_jobs.get()))
+        except (tk.TclError, ValueError):
+            return DEFAULT_PARALLEL_JOBS
+
+    def enqueue_job(self, subscription_id_blob, username, media_type, post_limit, browser, metadata, duplicates):
+        job_id = str(self.next_job_id)
+        self.next_job_id += 1
+        self.jobs[job_id] = {
+            "id": job_id,
+            "subscription_id": subscription_id_blob,
+            "username": username,
+            "media_type": media_type,
+            "post_limit": post_limit,
+            "browser": browser,
+            "metadata": metadata,
+            "duplicates": duplicates,
+            "status": "Queued",
+            "files": 0,
+            "cancel": threading.Event(),
+        }
+        self.job_tree.insert("", tk.END, iid=job_id, values=(username, media_type, "Queued", ""))
+
+    def set_job_status(self, job, status, files_text=None):
+        job["status"] = status
+        self.job_tree.set(job["id"], "status", status)
+        if files_text is not None:
+            self.job_tree.set(job["id"], "files", files_text)
+
+    def dispatch_jobs(self):
+        """Starts queued jobs while fewer than the configured number are running."""
+        if self.closing:
+            return
+        running = sum(1 for job in self.jobs.values() if job["status"] in ("Running", "Cancelling"))
+        started = False
+        for job in self.jobs.values():
+            if running >= self.max_parallel_jobs():
+                break
+            if job["status"] != "Queued":
+                continue
+            if self.writer is None:
+                self.run_report = StageReport(run_id=new_run_id(), mode="gui")
+                self.thumbnails = ThumbnailStage(FFMPEG_EXE)
+                self.writer = DatabaseWriter(get_repository(), report=self.run_report).start()
+                self.content_index = ContentIndex(CONTENT_INDEX_FILE)
+                self.scheduler = DownloadScheduler(
+                    self.settings.get("launches_per_minute", DEFAULT_LAUNCHES_PER_MINUTE),
+                    max_concurrency=self.max_parallel_jobs()
+                )
+            self.scheduler.set_max_concurrency(self.max_parallel_jobs())
+            job["files"] = 0
+            self.set_job_status(job, "Running", "0")
+            running += 1
+            started = True
+            threading.Thread(target=self.job_worker, args=(job,), daemon=True).start()
+        if started:
+            self.update_queue_progress()
+
+    def job_worker(self, job):
+        username = job["username"]
+        status, files = "Failed", None
+        try:
+            inserted = download_media(
+                job["subscription_id"], username, lambda text: self.log_output(f"[{username}] {text}"),
+                job["media_type"], job["post_limit"], job["browser"],
+                writer=self.writer, thumbnails=self.thumbnails, metadata=job["metadata"],
+                progress_callback=lambda done, total: self.events.put(("job_progress", (job["id"], done, total))),
+                cancel=job["cancel"], content_index=self.content_index, duplicates=job["duplicates"],
+                report=self.run_report, profile=self.settings.get("profile", False), scheduler=self.scheduler
+            )
+            if inserted is not None:
+                status, files = "Done", inserted
+        except DownloadCancelled:
+            status = "Cancelled"
         except Exception as e:
-            self.log_output(f"❌ Error: {e}")
+            self.log_output(f"[{username}] ❌ Error: {e}")
         finally:
-            self.progress.stop()
-            self.start_button.config(state="normal")
+            self.events.put(("job_done", (job["id"], status, files)))
+
+    def update_job_progress(self, job_id, done, total):
+        job = self.jobs.get(job_id)
+        if job and job["status"] == "Running":
+            job["files"] = done
+            self.job_tree.set(job_id, "files", f"{done}/{total}" if total else done)
+        self.update_queue_progress()
+
+    def finish_job(self, job_id, status, files):
+        job = self.jobs.get(job_id)
+        if job:
+            job["ended"] = time.monotonic()
+            self.set_job_status(job, status, f"{files} new" if files is not None else None)
+        self.dispatch_jobs()
+        self.update_queue_progress()
+
+    def update_queue_progress(self):
+        counts = {}
+        for job in self.jobs.values():
+            counts[job["status"]] = counts.get(job["status"], 0) + 1
+        active = counts.get("Queued", 0) + counts.get("Running", 0) + counts.get("Cancelling", 0)
+        finished = counts.get("Done", 0) + counts.get("Failed", 0)
+        if not active:
+            if self.jobs:
+                self.progress.config(maximum=max(1, finished), value=finished)
+                self.progress_label.config(
+                    text=f"Jobs: {counts.get('Done', 0)} done, {counts.get('Failed', 0)} failed, "
+                         f"{counts.get('Cancelled', 0)} cancelled"
+                )
+            return
+        self.progress.config(maximum=active + finished, value=finished)
+        elapsed = time.monotonic() - self.job_started if self.job_started else 0
+        files = sum(job["files"] for job in self.jobs.values())
+        rate = files / elapsed if elapsed > 0 else 0.0
+        # Jobs finished since the queue last went idle set the pace for the ones still queued or running
+        done_now = sum(
+            1 for job in self.jobs.values()
+            if job["status"] in ("Done", "Failed") and self.job_started and job.get("ended", 0) >= self.job_started
+        )
+        eta = f"ETA {format_eta(active * elapsed / done_now)}" if done_now and elapsed > 0 else "ETA --:--"
+        self.progress_label.config(
+            text=f"Jobs: {counts.get('Running', 0)} running, {counts.get('Queued', 0)} queued, "
+                 f"{finished} finished · {files} files · {rate:.1f} files/s · {eta}"
+        )
 
-    def add_manual_media(self):
-        if not self.user_var.get():
-            messagebox.showwarning("Warning", "Please select a user.")
+    def selected_jobs(self):
+        return [self.jobs[iid] for iid in self.job_tree.selection() if iid in self.jobs]
+
+    def cancel_jobs(self):
+        for job in self.selected_jobs():
+            if job["status"] == "Queued":
+                self.set_job_status(job, "Cancelled")
+            elif job["status"] == "Running":
+                job["cancel"].set()
+                self.set_job_status(job, "Cancelling")
+        self.update_queue_progress()
+
+    def retry_jobs(self):
+        if not any(job["status"] in ("Queued", "Running", "Cancelling") for job in self.jobs.values()):
+            self.job_started = time.monotonic()
+        for job in self.selected_jobs():
+            if job["status"] in ("Failed", "Cancelled"):
+                job["cancel"] = threading.Event()
+                job["files"] = 0
+                self.set_job_status(job, "Queued", "")
+        self.dispatch_jobs()
+
+    def clear_finished_jobs(self):
+        for job_id, job in list(self.jobs.items()):
+            if job["status"] in ("Done", "Failed", "Cancelled"):
+                self.job_tree.delete(job_id)
+                del self.jobs[job_id]
+        self.update_queue_progress()
+
+    def on_close(self):
+        """Cancels every job and closes the window once the running ones have stopped."""
+        if self.closing:
+            return
+        self.closing = True
+        self.start_button.config(state="disabled")
+        for job in self.jobs.values():
+            if job["status"] == "Queued":
+                self.set_job_status(job, "Cancelled")
+            elif job["status"] == "Running":
+                job["cancel"].set()
+                self.set_job_status(job, "Cancelling")
+        self.finish_close()
+
+    def finish_close(self):
+        """Waits (on the Tk loop) for running jobs and workers, then closes the shared stages and the window."""
+        stopping = sum(1 for job in self.jobs.values() if job["status"] in ("Running", "Cancelling"))
+        stopping += sum(1 for worker in self.workers if worker.is_alive())
+        if stopping:
+            self.root.title(f"Instagram Media Downloader Pro (closing, waiting for {stopping} tasks...)")
+            self.root.after(EVENT_POLL_MS, self.finish_close)
             return
+        if self.writer is not None:
+            self.thumbnails.close()
+            self.writer.close()
+            self.content_index.close()
+            try:
+                write_json(REPORT_DIR / f"run-{self.run_report.info['run_id']}.json", self.run_report.to_dict())
+            except OSError:
+                pass
+        close_journal()
+        close_repository()
+        self.root.destroy()
 
-        index = self.user_dropdown.current()
-        if index < 0 or index >= len(self.users):
-            messagebox.showerror("Error", "Invalid user selection.")
+    def add_manual_media(self):
+        users = self.selected_users()
+        if len(users) != 1:
+            messagebox.showwarning("Warning", "Please select exactly one user.")
             return
 
-        subscription_id_blob, username = self.users[index]
+        subscription_id_blob, username = users[0]
 
         file_paths = filedialog.askopenfilenames(
             title="Select media files to insert",
@@ -365,69 +632,42 @@ class InstagramDownloaderApp:
         )
         if not file_paths:
             return
+        self.start_manual_import(subscription_id_blob, username, file_paths)
 
-        conn = sqlite3.connect(DB_FILE)
-        cursor = conn.cursor()
-        created_time = int(time.time())
-
-        cursor.execute(f"SELECT instagram_id FROM {SUBSCRIPTIONS_TABLE} WHERE query = ?", (username,))
-        result = cursor.fetchone()
-        owner_id = result[0] if result else None
-
-        user_media_path = MEDIA_BASE_PATH / username
-        user_thumb_path = user_media_path / THUMBNAIL_FOLDER_NAME
-        user_media_path.mkdir(parents=True, exist_ok=True)
-        user_thumb_path.mkdir(parents=True, exist_ok=True)
-
-        for fpath in file_paths:
-            fpath = Path(fpath)
-
-            dest_path = user_media_path / fpath.name
-            if not dest_path.exists():
-                try:
-                    import shutil
-                    shutil.copy(fpath, dest_path)
-                except Exception as e:
-                    self.log_output(f"❌ Failed to copy {fpath}: {e}")
-                    continue
+    def add_manual_folder(self):
+        """Imports every media file below a folder, including its subfolders."""
+        users = self.selected_users()
+        if len(users) != 1:
+            messagebox.showwarning("Warning", "Please select exactly one user.")
+            return
 
-            file_relative_path = str(dest_path.relative_to(MEDIA_BASE_PATH.parent))
+        subscription_id_blob, username = users[0]
 
-            cursor.execute(f"SELECT COUNT(*) FROM {MEDIA_TABLE} WHERE file = ?", (file_relative_path,))
-            if cursor.fetchone()[0] > 0:
-                self.log_output(f"Skipping existing: {fpath.name}")
-                continue
+        folder = filedialog.askdirectory(title="Select a folder to import")
+        if not folder:
+            return
+        self.start_manual_import(subscription_id_blob, username, None, folder)
 
-            if fpath.suffix.lower() == ".mp4":
-                thumb_name = f"{fpath.stem}.jpg"
-                thumb_path = user_thumb_path / thumb_name
-                subprocess.run([
-                    FFMPEG_EXE,
-                    "-ss", "3",
-                    "-i", str(dest_path),
-                    "-vframes", "1",
-                    str(thumb_path)
-                ], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-                thumbnail_relative_path = str(thumb_path.relative_to(MEDIA_BASE_PATH.parent))
-            else:
-                thumbnail_relative_path = file_relative_path
-
-            cursor.execute(f"""
-                INSERT INTO {MEDIA_TABLE} (subscriptionId, created_time, thumbnail_file, file, ownerName, ownerId)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                subscription_id_blob,
-                created_time,
-                thumbnail_relative_path,
-                file_relative_path,
-                username,
-                owner_id
-            ))
-            self.log_output(f"Inserted manually: {fpath.name}")
-
-        conn.commit()
-        conn.close()
-        self.log_output("\n✅ Manual insert complete.")
+    def start_manual_import(self, subscription_id_blob, username, file_paths, folder=None):
+        self.settings["duplicates"] = self.duplicates.get()
+        self.settings["import_strategy"] = self.import_strategy.get()
+        self.save_settings()
+        self.manual_started_ui()
+        self.start_worker(self.manual_media_worker, subscription_id_blob, username, file_paths, folder,
+                          self.duplicates.get(), self.import_strategy.get())
+
+    def manual_media_worker(self, subscription_id_blob, username, file_paths, folder, duplicates, strategy):
+        try:
+            if folder is not None:
+                self.log_output(f"Looking for media in {folder}...")
+                file_paths = find_media(folder)
+                self.log_output(f"Found {len(file_paths)} media files.")
+            insert_manual_media(subscription_id_blob, username, file_paths, self.log_output, duplicates, strategy,
+                                progress_callback=self.report_progress)
+        except Exception as e:
+            self.log_output(f"❌ Error: {e}")
+        finally:
+            self.events.put(("done", None))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,134 @@
+import sqlite3
+import threading
+import time
+
+from ingest import MediaRecord
+
+# === JOURNAL TUNING ===
+# A checkpoint commits the journal after this many changes or this many seconds, whichever comes first
+CHECKPOINT_EVERY = 50
+CHECKPOINT_SECONDS = 2.0
+BUSY_TIMEOUT_MS = 10000
+JOURNAL_STATES = ("downloaded", "thumbnailed", "inserted")
+
+
+class JobJournal:
+    """Persistent record of every file a download job has picked up and how far it got.
+
+    A file enters as "downloaded" (its thumbnail still to be made) or "thumbnailed" (ready for
+    its row), and becomes "inserted" once the database writer has committed the row. Entries
+    keep the whole row, so an interrupted run can be finished from the journal alone, without
+    running gallery-dl, rescanning folders or regenerating thumbnails that were already made.
+    Changes are committed in checkpoints, after CHECKPOINT_EVERY changes or by a background
+    thread every CHECKPOINT_SECONDS, rather than in one transaction per file. Each checkpoint
+    also drops the entries inserted since the last one, so the journal only holds unfinished files.
+    """
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._unsaved = 0
+        self._inserted = 0
+        self._stop = threading.Event()
+        self.conn = sqlite3.connect(self.path, check_same_thread=False)
+        self.conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        # Commits survive a crash of the app either way; only a power cut can lose the last few
+        self.conn.execute("PRAGMA synchronous = NORMAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                file TEXT PRIMARY KEY,
+                state TEXT NOT NULL,
+                subscription_id BLOB,
+                created_time INTEGER,
+                thumbnail_file TEXT,
+                owner_name TEXT,
+                owner_id INTEGER,
+                updated REAL NOT NULL
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_state ON entries (state)")
+        self.conn.commit()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(CHECKPOINT_SECONDS):
+            self.checkpoint()
+
+    def _changed(self, n=1):
+        """Counts unsaved changes and commits once CHECKPOINT_EVERY have piled up. Called under the lock."""
+        self._unsaved += n
+        if self._unsaved >= CHECKPOINT_EVERY:
+            self._commit()
+
+    def _commit(self):
+        """Drops the entries inserted since the last commit and commits. Called under the lock."""
+        if self._inserted:
+            self.conn.execute("DELETE FROM entries WHERE state = 'inserted'")
+            self._inserted = 0
+        self.conn.commit()
+        self._unsaved = 0
+
+    def add(self, record, state):
+        """Records a newly picked up file with the row it is going to get."""
+        record = MediaRecord(*record)
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (record.file, state, record.subscription_id, record.created_time, record.thumbnail_file,
+                 record.owner_name, record.owner_id, time.time())
+            )
+            self._changed()
+
+    def mark_thumbnailed(self, file, thumbnail_file):
+        with self._lock:
+            self.conn.execute(
+                "UPDATE entries SET state = 'thumbnailed', thumbnail_file = ?, updated = ? WHERE file = ?",
+                (thumbnail_file, time.time(), file)
+            )
+            self._changed()
+
+    def mark_inserted(self, records):
+        """Marks the files of committed rows as done; used as the database writer's `on_written`."""
+        now = time.time()
+        with self._lock:
+            self.conn.executemany(
+                "UPDATE entries SET state = 'inserted', updated = ? WHERE file = ?",
+                ((now, record.file) for record in records)
+            )
+            self._inserted += len(records)
+            self._changed(len(records))
+
+    def forget(self, file):
+        with self._lock:
+            self.conn.execute("DELETE FROM entries WHERE file = ?", (file,))
+            self._changed()
+
+    def unfinished(self):
+        """Returns (MediaRecord, state) for every file that has no committed row yet, oldest first."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT subscription_id, created_time, thumbnail_file, file, owner_name, owner_id, state "
+                "FROM entries WHERE state != 'inserted' ORDER BY updated"
+            ).fetchall()
+        return [(MediaRecord(*row[:6]), row[6]) for row in rows]
+
+    def checkpoint(self):
+        with self._lock:
+            if self._unsaved:
+                self._commit()
+
+    def prune(self):
+        """Drops the entries of inserted files, including those left by older versions."""
+        with self._lock:
+            self.conn.execute("DELETE FROM entries WHERE state = 'inserted'")
+            self._inserted = 0
+            self.conn.commit()
+            self._unsaved = 0
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.prune()
+        self.conn.close()
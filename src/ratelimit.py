@@ -0,0 +1,168 @@
+import re
+import threading
+import time
+from collections import deque
+
+# === RATE LIMIT DEFAULTS ===
+DEFAULT_LAUNCHES_PER_MINUTE = 6
+DEFAULT_BURST = 2
+DEFAULT_MAX_CONCURRENCY = 4
+# Concurrency grows by one after this many launches in a row with at least this success rate
+SUCCESS_WINDOW = 10
+SUCCESS_RATE_TO_GROW = 0.9
+THROTTLE_PAUSE = 120
+CHECKPOINT_PAUSE = 30 * 60
+MAX_PAUSE = 60 * 60
+POLL_SECONDS = 0.25
+OUTCOMES = ("ok", "throttled", "checkpoint", "failed", "cancelled")
+
+THROTTLE_PATTERN = re.compile(r"\b429\b|too many requests|rate.?limit|please wait a few minutes", re.I)
+CHECKPOINT_PATTERN = re.compile(
+    r"checkpoint|challenge_required|feedback_required|login_required|redirect(?:ed)? to login|/accounts/login", re.I
+)
+
+
+def is_limit_signal(line):
+    """True for gallery-dl output that says Instagram is throttling or has locked the session."""
+    return bool(THROTTLE_PATTERN.search(line) or CHECKPOINT_PATTERN.search(line))
+
+
+def classify(returncode, stderr):
+    """Returns the outcome of a gallery-dl run from its exit code and stderr.
+
+    A checkpoint or throttling message counts even when gallery-dl retried its way to exit
+    code 0, since it shows the session is close to its limit. Other non-zero exits are plain
+    failures that say nothing about the session.
+    """
+    if CHECKPOINT_PATTERN.search(stderr):
+        return "checkpoint"
+    if THROTTLE_PATTERN.search(stderr):
+        return "throttled"
+    return "ok" if returncode == 0 else "failed"
+
+
+class TokenBucket:
+    """Allows `capacity` launches at once, refilled at `rate` launches per second; a rate of 0 or less never waits."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        if self.rate <= 0:
+            return 0.0
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+
+class DownloadScheduler:
+    """Decides when gallery-dl may start, shared by every job of a session.
+
+    Each cookie identity (the browser the cookies come from) gets a token bucket that spaces
+    out its launches. A throttled run pauses all new launches of that identity, for twice as
+    long after each throttle in a row, and halves the number of concurrent runs; a checkpoint
+    pauses it for much longer and drops to the minimum. Concurrency grows back by one after
+    SUCCESS_WINDOW launches with a high enough success rate. With `launches_per_minute` 0 launches
+    are not spaced out, but throttles and checkpoints still pause them.
+    """
+
+    def __init__(self, launches_per_minute=DEFAULT_LAUNCHES_PER_MINUTE, burst=DEFAULT_BURST,
+                 max_concurrency=DEFAULT_MAX_CONCURRENCY, min_concurrency=1, throttle_pause=THROTTLE_PAUSE,
+                 checkpoint_pause=CHECKPOINT_PAUSE):
+        self.rate = launches_per_minute / 60
+        self.burst = burst
+        self.max_concurrency = max(1, max_concurrency)
+        self.min_concurrency = max(1, min(min_concurrency, self.max_concurrency))
+        self.concurrency = self.max_concurrency
+        self.throttle_pause = throttle_pause
+        self.checkpoint_pause = checkpoint_pause
+        self.active = 0
+        self.launches = 0
+        self.waited = 0.0
+        self.outcomes = {outcome: 0 for outcome in OUTCOMES}
+        self._buckets = {}
+        self._paused_until = {}
+        self._strikes = {}
+        self._recent = deque(maxlen=SUCCESS_WINDOW)
+        self._cond = threading.Condition()
+
+    def acquire(self, identity, cancel=None):
+        """Blocks until `identity` may launch: a free slot, no pause and a token.
+
+        Returns False if the `cancel` event was set while waiting.
+        """
+        started = time.monotonic()
+        with self._cond:
+            bucket = self._buckets.get(identity)
+            if bucket is None:
+                bucket = self._buckets[identity] = TokenBucket(self.rate, self.burst)
+            while True:
+                if cancel is not None and cancel.is_set():
+                    return False
+                now = time.monotonic()
+                delay = max(0.0, self._paused_until.get(identity, 0.0) - now)
+                if not delay and self.active < self.concurrency:
+                    delay = bucket.wait_time(now)
+                    if not delay:
+                        break
+                elif not delay:
+                    delay = POLL_SECONDS
+                # Wake up at least every POLL_SECONDS to notice a cancel
+                self._cond.wait(min(delay, POLL_SECONDS))
+            bucket.take()
+            self.active += 1
+            self.launches += 1
+            self.waited += time.monotonic() - started
+        return True
+
+    def release(self, identity, outcome):
+        """Frees the slot and adapts to the run's outcome. Returns the seconds `identity` is now paused for."""
+        with self._cond:
+            self.active -= 1
+            self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+            pause = 0
+            if outcome in ("throttled", "checkpoint"):
+                strikes = self._strikes[identity] = self._strikes.get(identity, 0) + 1
+                if outcome == "throttled":
+                    pause = min(MAX_PAUSE, self.throttle_pause * 2 ** (strikes - 1))
+                    self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+                else:
+                    pause = max(self.checkpoint_pause, self.throttle_pause * 2 ** (strikes - 1))
+                    self.concurrency = self.min_concurrency
+                self._paused_until[identity] = max(self._paused_until.get(identity, 0.0), time.monotonic() + pause)
+                self._recent.clear()
+            elif outcome == "ok":
+                self._strikes[identity] = 0
+                self._recent.append(True)
+                if len(self._recent) == SUCCESS_WINDOW and self.concurrency < self.max_concurrency:
+                    if sum(self._recent) / SUCCESS_WINDOW >= SUCCESS_RATE_TO_GROW:
+                        self.concurrency += 1
+                        self._recent.clear()
+            elif outcome == "failed":
+                self._recent.append(False)
+            self._cond.notify_all()
+        return pause
+
+    def set_max_concurrency(self, max_concurrency):
+        """Changes the upper bound; the current concurrency is only lowered to it, growth stays earned."""
+        with self._cond:
+            self.max_concurrency = max(1, max_concurrency)
+            self.min_concurrency = min(self.min_concurrency, self.max_concurrency)
+            self.concurrency = min(self.concurrency, self.max_concurrency)
+            self._cond.notify_all()
+
+    def summary(self):
+        with self._cond:
+            return (
+                f"Launches: {self.launches} ({self.outcomes['ok']} ok, {self.outcomes['throttled']} throttled, "
+                f"{self.outcomes['checkpoint']} checkpoints, {self.outcomes['failed']} failed), "
+                f"concurrency {self.concurrency}/{self.max_concurrency}, {self.waited:.0f}s spent waiting"
+            )
@@ -0,0 +1,250 @@
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import wait
+from pathlib import Path
+
+from downloader import (
+    MEDIA_BASE_PATH, THUMBNAIL_FOLDER_NAME, FFMPEG_EXE, REPORT_DIR, find_database, validate_database, get_repository
+)
+from ingest import DatabaseWriter, MediaRecord
+from thumbnails import ThumbnailStage, needs_thumbnail, thumbnail_name
+from scanner import MEDIA_EXTENSIONS
+from telemetry import new_run_id
+from batch import log
+
+# === RECONCILE DEFAULTS ===
+# How many findings of each kind are printed; the report file always has all of them
+EXAMPLES_SHOWN = 10
+PROGRESS_EVERY = 100000
+
+
+def walk_library(base=MEDIA_BASE_PATH, users=None):
+    """Yields (username, file) for the media files directly inside each user folder, in the order SQLite sorts `file`.
+
+    Only one folder listing is held at a time. Folder names are sorted with the separator
+    appended, which is how they compare inside full paths.
+    """
+    base = str(base)
+    try:
+        with os.scandir(base) as entries:
+            folders = [e.name for e in entries if e.is_dir(follow_symlinks=False)]
+    except FileNotFoundError:
+        return
+    for username in sorted(folders, key=lambda name: name + os.sep):
+        if users is not None and username not in users:
+            continue
+        folder = os.path.join(base, username)
+        with os.scandir(folder) as entries:
+            names = sorted(e.name for e in entries if e.name.lower().endswith(MEDIA_EXTENSIONS) and e.is_file())
+        for name in names:
+            yield username, os.path.join(folder, name)
+
+
+def stream_rows(repository, base=MEDIA_BASE_PATH, users=None):
+    """Yields (rowid, file, thumbnail_file) of the library's rows, ordered like walk_library."""
+    base = str(base)
+    if users is None:
+        yield from repository.iter_media_rows(base + os.sep)
+        return
+    for username in sorted(users, key=lambda name: name + os.sep):
+        yield from repository.iter_media_rows(os.path.join(base, username) + os.sep)
+
+
+def merge_sorted(files, rows):
+    """Pairs files and rows that are both sorted by path.
+
+    Yields (username, file, row) with `row` None for a file without a row and `file` None
+    (and `username` None) for a row without a file. A file with several rows is paired with each.
+    """
+    row = next(rows, None)
+    for username, file in files:
+        while row is not None and row[1] < file:
+            yield None, None, row
+            row = next(rows, None)
+        if row is None or row[1] != file:
+            yield username, file, None
+            continue
+        while row is not None and row[1] == file:
+            yield username, file, row
+            row = next(rows, None)
+    while row is not None:
+        yield None, None, row
+        row = next(rows, None)
+
+
+def reconcile(repository, users=None, insert_missing=False, regenerate_thumbnails=False, prune_dead=False,
+              dry_run=False, report_path=None):
+    """Compares the library folders with the media rows and fixes the requested kinds of drift.
+
+    Both sides are streamed in path order and merged, so memory grows with the number of
+    findings, not with the size of the library. Findings are written one JSON line each to
+    `report_path`. Fixes are applied after the merge, once the row stream is closed. With
+    `dry_run` set nothing is changed. Returns the counts of each finding and fix.
+    """
+    subscriptions = {username: blob for blob, username in repository.list_subscriptions()}
+    users = set(users) if users else None
+    counts = {"files": 0, "rows": 0, "missing_rows": 0, "unowned_files": 0, "dead_rows": 0,
+              "missing_thumbnails": 0, "inserted": 0, "thumbnails": 0, "pruned": 0}
+    examples = {}
+    missing_rows = []
+    missing_thumbnails = []
+    dead_rows = []
+
+    report = open(report_path, "w", encoding="utf-8") if report_path else None
+
+    def found(kind, **details):
+        counts[kind] += 1
+        shown = examples.setdefault(kind, [])
+        if len(shown) < EXAMPLES_SHOWN:
+            shown.append(details["file"])
+        if report:
+            report.write(json.dumps(dict(kind=kind, **details)) + "\n")
+
+    try:
+        pairs = merge_sorted(walk_library(MEDIA_BASE_PATH, users), stream_rows(repository, MEDIA_BASE_PATH, users))
+        for username, file, row in pairs:
+            if row is None:
+                counts["files"] += 1
+                if username in subscriptions:
+                    found("missing_rows", file=file, username=username)
+                    missing_rows.append((username, file))
+                else:
+                    found("unowned_files", file=file, username=username)
+                continue
+            counts["rows"] += 1
+            rowid, row_file, thumbnail_file = row
+            if file is None:
+                # The walk only lists top-level files, so look before calling a row dead
+                if not os.path.isfile(row_file):
+                    found("dead_rows", file=row_file, rowid=rowid)
+                    dead_rows.append(rowid)
+                    continue
+            else:
+                counts["files"] += 1
+            if thumbnail_file and thumbnail_file != row_file and not os.path.isfile(thumbnail_file):
+                found("missing_thumbnails", file=row_file, thumbnail_file=thumbnail_file)
+                missing_thumbnails.append((row_file, thumbnail_file))
+            if counts["rows"] % PROGRESS_EVERY == 0:
+                log(f"Checked {counts['rows']} rows and {counts['files']} files...")
+    finally:
+        if report:
+            report.close()
+
+    for kind in ("missing_rows", "unowned_files", "dead_rows", "missing_thumbnails"):
+        for file in examples.get(kind, []):
+            log(f"  {kind}: {file}")
+        if counts[kind] > len(examples.get(kind, [])):
+            log(f"  {kind}: ... and {counts[kind] - len(examples[kind])} more")
+
+    if dry_run:
+        return counts
+
+    thumbnails = ThumbnailStage(FFMPEG_EXE) if (insert_missing and missing_rows) or \
+        (regenerate_thumbnails and missing_thumbnails) else None
+    try:
+        if insert_missing and missing_rows:
+            counts["inserted"] = insert_rows(repository, missing_rows, subscriptions, thumbnails)
+        if regenerate_thumbnails and missing_thumbnails:
+            futures = []
+            for file, thumb in missing_thumbnails:
+                Path(thumb).parent.mkdir(parents=True, exist_ok=True)
+                futures.append(thumbnails.submit(Path(file), Path(thumb), log))
+            counts["thumbnails"] = sum(1 for future in futures if future.result())
+        if prune_dead and dead_rows:
+            counts["pruned"] = repository.delete_media_rows(dead_rows)
+    finally:
+        if thumbnails is not None:
+            thumbnails.close()
+    return counts
+
+
+def insert_rows(repository, missing_rows, subscriptions, thumbnails):
+    """Adds rows for (username, file) pairs, with a thumbnail where one is needed. Returns the rows written."""
+    owner_ids = {}
+    writer = DatabaseWriter(repository).start()
+    pending = []
+    try:
+        for username, file in missing_rows:
+            if username not in owner_ids:
+                owner_ids[username] = repository.owner_id_for(username)
+            path = Path(file)
+            try:
+                created_time = int(path.stat().st_mtime)
+            except OSError:
+                continue
+            record = MediaRecord(subscriptions[username], created_time, file, file, username, owner_ids[username])
+            if not needs_thumbnail(path):
+                writer.insert(record)
+                continue
+            thumb_path = path.parent / THUMBNAIL_FOLDER_NAME / thumbnail_name(path)
+            thumb_path.parent.mkdir(parents=True, exist_ok=True)
+            # Without a thumbnail the row points at the media itself rather than at a missing file
+            pending.append(thumbnails.submit(
+                path, thumb_path, log,
+                then=lambda ok, record=record, thumb=str(thumb_path): writer.insert(
+                    record._replace(thumbnail_file=thumb) if ok else record
+                )
+            ))
+    finally:
+        wait(pending)
+        writer.close()
+    log(writer.summary())
+    for error in writer.errors:
+        log(f"❌ Database write failed: {error}")
+    return writer.rows_written
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description=f"Compare the {MEDIA_BASE_PATH} folders with the database and fix files and rows that drifted apart."
+    )
+    parser.add_argument("--users", nargs="+", metavar="USERNAME", help="Only check these user folders")
+    parser.add_argument("--insert-missing", action="store_true", help="Add rows for media files that have none")
+    parser.add_argument("--regenerate-thumbnails", action="store_true",
+                        help="Recreate thumbnails that rows point to but that no longer exist")
+    parser.add_argument("--prune-dead", action="store_true", help="Delete rows whose media file no longer exists")
+    parser.add_argument("--fix", action="store_true", help="All of the above")
+    parser.add_argument("--dry-run", action="store_true", help="Only report what would be changed")
+    args = parser.parse_args(argv)
+    if args.fix:
+        args.insert_missing = args.regenerate_thumbnails = args.prune_dead = True
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    db_file = find_database()
+    if not db_file or not validate_database(db_file):
+        log("❌ No valid '.stogram.sqlite' database file was found in the current directory.")
+        return 2
+
+    report_path = REPORT_DIR / f"reconcile-{new_run_id()}.jsonl"
+    REPORT_DIR.mkdir(parents=True, exist_ok=True)
+    log(f"⏳ Comparing {MEDIA_BASE_PATH} with the database...")
+    started = time.monotonic()
+    counts = reconcile(get_repository(), args.users, args.insert_missing, args.regenerate_thumbnails,
+                       args.prune_dead, args.dry_run, report_path)
+
+    log("\n=== Reconcile summary ===")
+    log(f"Checked {counts['files']} files and {counts['rows']} rows in {time.monotonic() - started:.1f}s")
+    log(f"Files without a row: {counts['missing_rows']}"
+        + (f" ({counts['inserted']} inserted)" if args.insert_missing and not args.dry_run else ""))
+    log(f"Files in folders without a subscription: {counts['unowned_files']}")
+    log(f"Rows whose file is missing: {counts['dead_rows']}"
+        + (f" ({counts['pruned']} pruned)" if args.prune_dead and not args.dry_run else ""))
+    log(f"Rows whose thumbnail is missing: {counts['missing_thumbnails']}"
+        + (f" ({counts['thumbnails']} regenerated)" if args.regenerate_thumbnails and not args.dry_run else ""))
+    if args.dry_run:
+        log("Dry run: nothing was changed.")
+    elif not (args.insert_missing or args.regenerate_thumbnails or args.prune_dead):
+        log("Nothing changed; use --insert-missing, --regenerate-thumbnails, --prune-dead or --fix.")
+    log(f"Findings written to {report_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from ingest import KnownFilesIndex, MediaRecord, configure_connection, existing_files, ensure_file_index
+
+
+class StogramRepository:
+    """Data access for one 4K Stogram database, shared by the downloader and addusertodb.
+
+    Reads go through one long-lived connection and writes through a second one, each guarded by
+    its own lock, so concurrent jobs never open connections of their own. Every statement is a
+    fixed string built once here, which lets sqlite3's statement cache reuse the prepared
+    statements. The table layout is read once and cached, and so are the subscriptions'
+    `instagram_id` values that every job looks up. Time spent in queries is summed in `sql_seconds`.
+    """
+
+    def __init__(self, db_file, media_table="photos", subscriptions_table="subscriptions", wal=True):
+        self.db_file = str(db_file)
+        self.media_table = media_table
+        self.subscriptions_table = subscriptions_table
+        self.wal = wal
+        self.journal_mode = None
+        self._reader = None
+        self._writer = None
+        self._read_lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._schema = None
+        self._owner_ids = None
+        self._stats_lock = threading.Lock()
+        self.sql_seconds = 0.0
+
+        self.insert_media_sql = (
+            f"INSERT INTO {media_table} (subscriptionId, created_time, thumbnail_file, file, ownerName, ownerId) "
+            "VALUES (?, ?, ?, ?, ?, ?)"
+        )
+        self.insert_subscription_sql = (
+            f"INSERT INTO {subscriptions_table} (id, query, attributes, display_name, date_added) "
+            "VALUES (?, ?, ?, ?, ?)"
+        )
+
+    @contextmanager
+    def _timed(self):
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            with self._stats_lock:
+                self.sql_seconds += elapsed
+
+    def _connect(self):
+        # Connections are shared between threads, always under one of the locks
+        return sqlite3.connect(self.db_file, check_same_thread=False)
+
+    @property
+    def reader(self):
+        with self._read_lock:
+            if self._reader is None:
+                self._reader = self._connect()
+                configure_connection(self._reader, wal=False)
+            return self._reader
+
+    def _write_connection(self):
+        if self._writer is None:
+            self._writer = self._connect()
+            self.journal_mode = configure_connection(self._writer, self.wal)
+        return self._writer
+
+    def schema(self):
+        """Returns {table: [columns]} for every table, read from the database once."""
+        with self._read_lock:
+            if self._schema is None:
+                with self._timed():
+                    schema = {}
+                    tables = self.reader.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+                    for (table,) in tables:
+                        quoted = table.replace('"', '""')
+                        schema[table] = [row[1] for row in self.reader.execute(f'PRAGMA table_info("{quoted}")')]
+                self._schema = schema
+            return self._schema
+
+    def has_column(self, table, column):
+        return column in self.schema().get(table, ())
+
+    def is_valid(self):
+        """Returns True if the database has the media and subscriptions tables."""
+        try:
+            schema = self.schema()
+        except sqlite3.Error:
+            return False
+        return self.media_table in schema and self.subscriptions_table in schema
+
+    def list_subscriptions(self):
+        """Returns (id, query) for every usable subscription and refreshes the cached owner IDs."""
+        with self._read_lock:
+            has_owner_id = self.has_column(self.subscriptions_table, "instagram_id")
+            with self._timed():
+                if has_owner_id:
+                    rows = self.reader.execute(
+                        f"SELECT id, query, instagram_id FROM {self.subscriptions_table} "
+                        "WHERE id IS NOT NULL AND query IS NOT NULL"
+                    ).fetchall()
+                else:
+                    rows = [row + (None,) for row in self.reader.execute(
+                        f"SELECT id, query FROM {self.subscriptions_table} WHERE id IS NOT NULL AND query IS NOT NULL"
+                    )]
+            self._owner_ids = {query: owner_id for _, query, owner_id in rows}
+        return [(subscription_id, query) for subscription_id, query, _ in rows]
+
+    def owner_id_for(self, username):
+        """Returns the subscription's instagram_id, served from memory after the first lookup."""
+        with self._read_lock:
+            if self._owner_ids is None:
+                self.list_subscriptions()
+            return self._owner_ids.get(username)
+
+    def subscription_names(self):
+        with self._read_lock, self._timed():
+            return {row[0] for row in self.reader.execute(f"SELECT query FROM {self.subscriptions_table}")}
+
+    def known_files(self, subscription_id):
+        """Loads the KnownFilesIndex of one subscription with a single query."""
+        with self._read_lock, self._timed():
+            return KnownFilesIndex.load(self.reader, subscription_id, self.media_table)
+
+    def existing_files(self, files):
+        """Returns the subset of `files` that already has a row."""
+        with self._read_lock, self._timed():
+            return existing_files(self.reader, files, self.media_table)
+
+    def media_files(self):
+        """Returns the `file` of every media row."""
+        with self._read_lock, self._timed():
+            return [row[0] for row in self.reader.execute(
+                f"SELECT file FROM {self.media_table} WHERE file IS NOT NULL"
+            )]
+
+    def iter_media_rows(self, prefix, batch_size=1000):
+        """Yields (rowid, file, thumbnail_file) for every row whose `file` starts with `prefix`, ordered by file.
+
+        Rows are streamed through a connection of their own, `batch_size` at a time, so neither the
+        whole result nor the shared reader is held while the caller works through them.
+        """
+        # [prefix, prefix with its last character bumped) is a range the file index can answer
+        upper = prefix[:-1] + chr(ord(prefix[-1]) + 1)
+        conn = self._connect()
+        try:
+            configure_connection(conn, wal=False)
+            cursor = conn.execute(
+                f"SELECT rowid, file, thumbnail_file FROM {self.media_table} "
+                "WHERE file >= ? AND file < ? ORDER BY file",
+                (prefix, upper)
+            )
+            while True:
+                with self._timed():
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+        finally:
+            conn.close()
+
+    def delete_media_rows(self, rowids, batch_size=500):
+        """Deletes media rows by rowid, one transaction per batch. Returns the number deleted."""
+        rowids = list(rowids)
+        deleted = 0
+        with self._write_lock, self._timed():
+            conn = self._write_connection()
+            for start in range(0, len(rowids), batch_size):
+                with conn:
+                    deleted += conn.executemany(
+                        f"DELETE FROM {self.media_table} WHERE rowid = ?",
+                        ((rowid,) for rowid in rowids[start:start + batch_size])
+                    ).rowcount
+        return deleted
+
+    def ensure_file_index(self, create=False):
+        with self._write_lock, self._timed():
+            return ensure_file_index(self._write_connection(), self.media_table, create)
+
+    def insert_media_batch(self, records):
+        """Inserts the records that have no row yet in one transaction.
+
+        Returns (rows written, rows skipped, seconds spent in the write transaction).
+        """
+        records = [MediaRecord(*record) for record in records]
+        with self._write_lock, self._timed():
+            conn = self._write_connection()
+            known = existing_files(conn, (r.file for r in records), self.media_table)
+            rows = []
+            for record in records:
+                if record.file in known:
+                    continue
+                known.add(record.file)
+                rows.append(record)
+            if not rows:
+                return 0, len(records), 0.0
+            # Only the insert itself runs inside the write transaction
+            started = time.monotonic()
+            with conn:
+                conn.executemany(self.insert_media_sql, rows)
+            return len(rows), len(records) - len(rows), time.monotonic() - started
+
+    def add_subscriptions(self, rows):
+        """Inserts (id, username, attributes, date_added) rows in a single transaction."""
+        with self._write_lock, self._timed():
+            conn = self._write_connection()
+            with conn:
+                conn.executemany(self.insert_subscription_sql, (
+                    (subscription_id, username, attributes, username, date_added)
+                    for subscription_id, username, attributes, date_added in rows
+                ))
+        with self._read_lock:
+            self._owner_ids = None
+
+    def add_subscription(self, subscription_id, username, attributes, date_added):
+        self.add_subscriptions([(subscription_id, username, attributes, date_added)])
+
+    def close(self):
+        with self._write_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        with self._read_lock:
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
@@ -0,0 +1,73 @@
+import json
+import os
+import threading
+from pathlib import Path
+
+from telemetry import write_json
+
+MEDIA_EXTENSIONS = (".jpg", ".jpeg", ".png", ".mp4")
+
+# Jobs of several media types of one user share a manifest; their commits take turns
+_commit_locks = {}
+_commit_locks_lock = threading.Lock()
+
+
+def _commit_lock(path):
+    with _commit_locks_lock:
+        return _commit_locks.setdefault(os.path.abspath(path), threading.Lock())
+
+
+class FolderScanner:
+    """Finds media files added or changed in a folder since the previous committed scan.
+
+    The name, size and mtime of every file seen are kept in a small JSON manifest, so a rescan
+    costs one os.scandir pass and never depends on how long the download took.
+    """
+
+    def __init__(self, folder, manifest_path, extensions=MEDIA_EXTENSIONS):
+        self.folder = Path(folder)
+        self.manifest_path = Path(manifest_path)
+        self.extensions = tuple(extensions)
+        self.seen = self._load()
+        self._pending = None
+
+    def _load(self):
+        try:
+            with open(self.manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def scan(self):
+        """Returns the names of new or changed media files, oldest first."""
+        current = {}
+        changed = []
+        with os.scandir(self.folder) as entries:
+            for entry in entries:
+                if not entry.name.lower().endswith(self.extensions) or not entry.is_file():
+                    continue
+                stat = entry.stat()
+                signature = [stat.st_size, stat.st_mtime_ns]
+                current[entry.name] = signature
+                if self.seen.get(entry.name) != signature:
+                    changed.append((stat.st_mtime_ns, entry.name))
+        self._pending = current
+        return [name for _, name in sorted(changed)]
+
+    def commit(self):
+        """Persists the last scan so its files are not reported again.
+
+        Another job of the same folder may have committed since this scan, so files it recorded
+        that this scan did not see are kept as long as they still exist.
+        """
+        if self._pending is None:
+            return
+        with _commit_lock(self.manifest_path):
+            merged = {
+                name: signature for name, signature in self._load().items()
+                if name not in self._pending and (self.folder / name).is_file()
+            }
+            merged.update(self._pending)
+            write_json(self.manifest_path, merged, indent=None)
+        self.seen = merged
+        self._pending = None
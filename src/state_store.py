@@ -0,0 +1,197 @@
+import copy
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from telemetry import write_json
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+# === PROFILE TUNING ===
+# Weight of the newest run in a profile's average job duration
+DURATION_SMOOTHING = 0.3
+# A sync that found nothing is skipped for quiet_interval, doubled per further empty sync up to this many times
+MAX_QUIET_DOUBLINGS = 3
+
+
+@contextmanager
+def file_lock(path):
+    """Holds an exclusive lock on `path` (created if missing) that other processes wait for.
+
+    On Windows msvcrt gives up with OSError after about 10 seconds.
+    """
+    with open(path, "a+b") as f:
+        if os.name == "nt":
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+        else:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if os.name == "nt":
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class JsonStore:
+    """A JSON object kept in memory and written atomically whenever a value changes.
+
+    Reads are served from memory. Every change happens on a fresh copy while holding both a
+    thread lock and an OS-level lock on a sibling `.lock` file: the file is read again first if
+    another process replaced it since, and only the keys being changed are written back, so a
+    GUI session and a batch run do not undo each other. Changes that depend on the current value
+    go through `modify`. Write errors are raised.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.lock_path = self.path.with_name(self.path.name + ".lock")
+        self._lock = threading.Lock()
+        self._data, self._signature = self._read()
+
+    def _stat_signature(self):
+        # Every write replaces the file, so the inode changes even when mtime and size do not
+        try:
+            stat = os.stat(self.path)
+            return stat.st_ino, stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _read(self):
+        signature = self._stat_signature()
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        return (data if isinstance(data, dict) else {}), signature
+
+    def get(self, key, default=None):
+        with self._lock:
+            return copy.deepcopy(self._data.get(key, default))
+
+    def snapshot(self):
+        with self._lock:
+            return copy.deepcopy(self._data)
+
+    def update(self, values):
+        """Stores the given keys and writes the file if any of them changed. Returns True if it was written."""
+        return self.modify_many(values, lambda key, value: values[key])
+
+    def modify(self, key, fn, default=None):
+        """Replaces the value of `key` by `fn(current value)`, atomically with respect to other changes.
+
+        `fn` gets a copy of the value as it is on disk (or `default`) and returns the new value.
+        Returns True if the file was written.
+        """
+        return self.modify_many([key], lambda key, value: fn(value), default)
+
+    def modify_many(self, keys, fn, default=None):
+        """Like `modify` for several keys, with `fn(key, current value)`, in a single write."""
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with file_lock(self.lock_path):
+                if self._stat_signature() != self._signature:
+                    self._data, self._signature = self._read()
+                changed = {}
+                for key in keys:
+                    current = copy.deepcopy(self._data.get(key, default))
+                    value = fn(key, current)
+                    if key not in self._data or self._data[key] != value:
+                        changed[key] = value
+                if not changed:
+                    return False
+                data = dict(self._data)
+                data.update(copy.deepcopy(changed))
+                write_json(self.path, data)
+                self._data = data
+                self._signature = self._stat_signature()
+                return True
+
+
+class UserProfiles:
+    """Per-user preferences and sync history, kept in a JsonStore keyed by username.
+
+    A profile holds the user's preferred `media_types` and `post_limit` (the last ones picked for
+    them in the GUI) and, for each media type, the time of the last attempt and the last
+    successful sync, the newest item seen, how many syncs in a row found nothing new and a
+    smoothed average job duration.
+    """
+
+    def __init__(self, path):
+        self.store = JsonStore(path)
+
+    def profile(self, username):
+        return self.store.get(username) or {}
+
+    def _sync_entry(self, username, media_type):
+        return self.profile(username).get("types", {}).get(media_type, {})
+
+    def media_types(self, username):
+        return self.profile(username).get("media_types")
+
+    def post_limit(self, username, default):
+        return self.profile(username).get("post_limit", default)
+
+    def set_preferences(self, usernames, media_types, post_limit):
+        """Remembers the media types and post limit picked for these users, in a single write."""
+        def apply(username, profile):
+            profile["media_types"] = list(media_types)
+            profile["post_limit"] = post_limit
+            return profile
+
+        return self.store.modify_many(usernames, apply, {})
+
+    def record_sync(self, username, media_type, status, new_items, duration, last_item=None, now=None):
+        """Adds the outcome of one job; cancelled jobs only count as an attempt.
+
+        Only this media type's entry of the profile is touched, on the profile as it is on disk,
+        so jobs of other media types and other processes keep their records.
+        """
+        now = time.time() if now is None else now
+
+        def apply(profile):
+            entry = profile.setdefault("types", {}).setdefault(media_type, {})
+            entry["last_attempt"] = now
+            entry["last_status"] = status
+            if status != "cancelled":
+                average = entry.get("avg_duration")
+                entry["avg_duration"] = round(duration if average is None else
+                                              average + DURATION_SMOOTHING * (duration - average), 3)
+            if status == "ok":
+                entry["last_sync"] = now
+                entry["last_new"] = new_items
+                entry["quiet_runs"] = 0 if new_items else entry.get("quiet_runs", 0) + 1
+                if last_item:
+                    entry["last_item"] = last_item
+            return profile
+
+        self.store.modify(username, apply, {})
+
+    def expected_duration(self, username, media_type):
+        """Average seconds a job of this user and media type took, or None before the first one."""
+        return self._sync_entry(username, media_type).get("avg_duration")
+
+    def quiet_runs(self, username, media_type):
+        return self._sync_entry(username, media_type).get("quiet_runs", 0)
+
+    def is_quiet(self, username, media_type, quiet_interval, now=None):
+        """True while the last sync found nothing new and is less than the quiet interval old.
+
+        The interval doubles with every further empty sync in a row, up to MAX_QUIET_DOUBLINGS times.
+        """
+        entry = self._sync_entry(username, media_type)
+        quiet_runs = entry.get("quiet_runs", 0)
+        if not quiet_interval or not quiet_runs or entry.get("last_sync") is None:
+            return False
+        now = time.time() if now is None else now
+        return now - entry["last_sync"] < quiet_interval * 2 ** min(quiet_runs - 1, MAX_QUIET_DOUBLINGS)
@@ -0,0 +1,238 @@
+import json
+import os
+import re
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from telemetry import write_json
+
+MANIFEST_NAME = ".manifest.json"
+VIDEO_EXTENSIONS = (".mp4",)
+# Longest side of a generated thumbnail, in pixels
+THUMBNAIL_MAX_SIZE = 640
+THUMBNAIL_QUALITY = 4
+# Images smaller than this are shown as they are instead of getting a thumbnail
+IMAGE_THUMBNAIL_MIN_BYTES = 256 * 1024
+DEFAULT_SEEK = 3.0
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+SCALE_FILTER = (
+    f"scale='min({THUMBNAIL_MAX_SIZE},iw)':'min({THUMBNAIL_MAX_SIZE},ih)':force_original_aspect_ratio=decrease"
+)
+
+
+def is_video(path):
+    return str(path).lower().endswith(VIDEO_EXTENSIONS)
+
+
+def needs_thumbnail(path):
+    """Videos always need a thumbnail; images only when they are too large to show as they are."""
+    if is_video(path):
+        return True
+    try:
+        return os.stat(path).st_size > IMAGE_THUMBNAIL_MIN_BYTES
+    except OSError:
+        return False
+
+
+def thumbnail_name(path):
+    """Videos keep the `<stem>.jpg` name; image thumbnails carry the extension so they never clash with one."""
+    path = Path(path)
+    if is_video(path):
+        return f"{path.stem}.jpg"
+    return f"{path.stem}_{path.suffix.lstrip('.').lower()}.jpg"
+
+
+def seek_point(duration):
+    """A quarter into the clip, but no later than DEFAULT_SEEK; DEFAULT_SEEK if the duration is unknown."""
+    if duration is None:
+        return DEFAULT_SEEK
+    return max(0.0, min(DEFAULT_SEEK, duration / 4))
+
+
+class ThumbnailManifest:
+    """Remembers the size and mtime of every source that already has an up-to-date thumbnail."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.dirty = False
+        try:
+            with open(self.path, "r") as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            self.entries = {}
+
+    def is_current(self, source, stat, thumb):
+        entry = self.entries.get(Path(source).name)
+        return entry == [stat.st_size, stat.st_mtime_ns, Path(thumb).name]
+
+    def record(self, source, stat, thumb):
+        self.entries[Path(source).name] = [stat.st_size, stat.st_mtime_ns, Path(thumb).name]
+        self.dirty = True
+
+    def save(self):
+        if not self.dirty:
+            return
+        write_json(self.path, self.entries, indent=None)
+        self.dirty = False
+
+
+class ThumbnailStage:
+    """Generates scaled-down JPEG thumbnails of videos and images with ffmpeg on a pool sized to the cores.
+
+    Sources whose thumbnail is newer than the source, or whose size and mtime match the manifest
+    kept in the thumbnail folder, are skipped without starting ffmpeg. A video's duration is
+    probed first so the frame is taken from inside the clip, with a retry at the first frame.
+    """
+
+    def __init__(self, ffmpeg_exe, workers=None):
+        self.ffmpeg_exe = ffmpeg_exe
+        self.generated = 0
+        self.skipped = 0
+        self.failed = 0
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+        self._manifests = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 4)
+
+    def _manifest_for(self, thumb):
+        folder = Path(thumb).parent
+        with self._lock:
+            manifest = self._manifests.get(folder)
+            if manifest is None:
+                manifest = self._manifests[folder] = ThumbnailManifest(folder / MANIFEST_NAME)
+            return manifest
+
+    def _is_fresh(self, source, stat, thumb, manifest):
+        # The manifest cannot tell that a thumbnail was deleted since, so the thumbnail must exist
+        try:
+            thumb_stat = os.stat(thumb)
+        except OSError:
+            return False
+        with self._lock:
+            if manifest.is_current(source, stat, thumb):
+                return True
+        return thumb_stat.st_mtime_ns >= stat.st_mtime_ns
+
+    def _generate(self, source, thumb, output_callback):
+        manifest = self._manifest_for(thumb)
+        try:
+            stat = os.stat(source)
+        except OSError as e:
+            self._failed(f"❌ Thumbnail failed for {Path(source).name}: {e}", output_callback)
+            return False
+
+        if self._is_fresh(source, stat, thumb, manifest):
+            with self._lock:
+                manifest.record(source, stat, thumb)
+                self.skipped += 1
+            return True
+
+        if is_video(source):
+            seek = seek_point(self._probe_duration(source))
+            attempts = [seek, 0.0] if seek > 0 else [0.0]
+        else:
+            attempts = [None]
+        for seek in attempts:
+            reason = self._render(source, thumb, seek)
+            if reason is None:
+                break
+        else:
+            self._failed(f"❌ Thumbnail failed for {Path(source).name}: {reason}", output_callback)
+            return False
+
+        with self._lock:
+            manifest.record(source, stat, thumb)
+            self.generated += 1
+        return True
+
+    def _probe_duration(self, source):
+        """Reads the duration from ffmpeg's stream summary (ffmpeg exits with an error as there is no output)."""
+        result = subprocess.run(
+            [self.ffmpeg_exe, "-hide_banner", "-i", str(source)],
+            stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, errors="replace"
+        )
+        match = DURATION_PATTERN.search(result.stderr)
+        if not match:
+            return None
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def _render(self, source, thumb, seek):
+        """Writes one scaled frame of `source` to `thumb`; returns None on success or the reason it failed."""
+        # ffmpeg picks the muxer from the extension, so the temporary file keeps .jpg
+        tmp_path = Path(thumb).with_name(f"{Path(thumb).stem}.tmp.jpg")
+        command = [self.ffmpeg_exe, "-y", "-loglevel", "error"]
+        if seek is not None:
+            # -ss before -i seeks on the input, which jumps to the nearest keyframe instead of decoding up to it
+            command += ["-ss", f"{seek:.3f}"]
+        command += ["-i", str(source), "-frames:v", "1", "-vf", SCALE_FILTER, "-q:v", str(THUMBNAIL_QUALITY),
+                    str(tmp_path)]
+        result = subprocess.run(command, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                                text=True, errors="replace")
+        try:
+            if result.returncode != 0:
+                return result.stderr.strip().splitlines()[-1] if result.stderr.strip() else f"exit code {result.returncode}"
+            # A seek past the end exits cleanly without writing a frame
+            if not tmp_path.is_file() or tmp_path.stat().st_size == 0:
+                return f"no frame at {seek or 0:.1f}s"
+            os.replace(tmp_path, thumb)
+            return None
+        finally:
+            try:
+                tmp_path.unlink()
+            except OSError:
+                pass
+
+    def _failed(self, message, output_callback):
+        with self._lock:
+            self.failed += 1
+        if output_callback:
+            output_callback(message)
+
+    def _job(self, source, thumb, output_callback, then, report):
+        started = time.monotonic()
+        ok = self._generate(source, thumb, output_callback)
+        if report is not None:
+            report.record("thumbnail", time.monotonic() - started)
+            report.count("thumbnails_ok" if ok else "thumbnails_failed")
+        if then:
+            then(ok)
+        return ok
+
+    def submit(self, source, thumb, output_callback=None, then=None, report=None):
+        """Queues one thumbnail; the returned future resolves to True on success.
+
+        `then(ok)` runs on the worker right after the thumbnail, before the future resolves.
+        Its duration is recorded as the "thumbnail" stage of `report` when given.
+        """
+        return self._pool.submit(self._job, source, thumb, output_callback, then, report)
+
+    def generate(self, jobs, output_callback=None):
+        """Generates thumbnails for (source, thumb) pairs and returns {source: success}."""
+        futures = {source: self.submit(source, thumb, output_callback) for source, thumb in jobs}
+        results = {source: future.result() for source, future in futures.items()}
+        self.save()
+        return results
+
+    def save(self):
+        with self._lock:
+            for manifest in self._manifests.values():
+                try:
+                    manifest.save()
+                except OSError:
+                    pass
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+        self.save()
+
+    def summary(self):
+        elapsed = time.monotonic() - self._started
+        rate = self.generated / elapsed if elapsed > 0 else 0.0
+        return (
+            f"Thumbnails: {self.generated} generated, {self.skipped} up to date, {self.failed} failed "
+            f"({rate:.1f}/s)"
+        )